@@ -1,12 +1,20 @@
 # api_agent.py
 
+import functools
+import logging
 import os
 import math
-from typing import List, Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
+from typing import List, Optional, Dict, Any, Iterable, Callable
 
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 from models import Recipe
 
+logger = logging.getLogger(__name__)
+
 # Try to use Streamlit secrets when available
 try:
     import streamlit as st
@@ -14,6 +22,28 @@ try:
 except Exception:
     _SECRETS = {}
 
+# Faster JSON decoding when orjson is available
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+except ImportError:
+    import json
+
+    _json_loads = json.loads
+
+# Optional incremental JSON parsing for large USDA payloads
+try:
+    import ijson
+except ImportError:
+    ijson = None  # type: ignore
+
+# Optional on-disk response cache
+try:
+    from diskcache import Cache
+except ImportError:
+    Cache = None  # type: ignore
+
 # OpenAI embeddings
 try:
     from openai import OpenAI
@@ -21,10 +51,81 @@ except ImportError:
     OpenAI = None  # type: ignore
 
 
+def _resolve_secret(name: str) -> Optional[str]:
+    """Prefer Streamlit secrets, fall back to env vars."""
+    try:
+        value = _SECRETS.get(name)
+    except Exception:
+        value = None
+    return value or os.getenv(name)
+
+
+# Resolved once per process: Streamlit reruns recreate agents constantly and
+# st.secrets is a lazily parsed TOML mapping
+_SPOONACULAR_KEY = _resolve_secret("SPOONACULAR_API_KEY")
+_USDA_KEY = _resolve_secret("USDA_API_KEY")
+_OPENAI_KEY = _resolve_secret("OPENAI_API_KEY")
+
+
+@functools.lru_cache(maxsize=1)
+def _openai_client(api_key: str):
+    """Shared embeddings client so agent re-creation keeps its HTTP pool."""
+    return OpenAI(api_key=api_key)
+
+
 class APIDataError(Exception):
     pass
 
 
+_USER_AGENT = "ist688-recipe-companion/1.0"
+
+# Request params that carry credentials; never part of a cache key
+_SECRET_PARAMS = frozenset({"apiKey", "api_key"})
+
+# Query words that never name an ingredient
+_STOP_TOKENS: frozenset = frozenset({
+    "high",
+    "low",
+    "protein",
+    "fibre",
+    "fiber",
+    "fat",
+    "carb",
+    "carbs",
+    "calorie",
+    "calories",
+    "healthy",
+    "recipe",
+    "recipes",
+    "meal",
+    "meals",
+    "for",
+    "with",
+    "and",
+    "please",
+})
+# Stripped from the ends of query tokens only, never from inside them
+_TOKEN_PUNCT = ".,!?"
+
+# Exact (lower-cased) nutrient names → Recipe macro field
+_SPOON_NUTRIENT_MAP = {
+    "calories": "calories",
+    "protein": "protein",
+    "carbohydrates": "carbs",
+    "fat": "fat",
+    "fiber": "fiber",
+}
+_USDA_NUTRIENT_MAP = {
+    "energy": "calories",
+    "energy (atwater general factors)": "calories",
+    "energy (atwater specific factors)": "calories",
+    "protein": "protein",
+    "carbohydrate, by difference": "carbs",
+    "total lipid (fat)": "fat",
+    "fiber, total dietary": "fiber",
+}
+
+
 class APIDataAgent:
     """
     Fetches and normalises recipe / nutrition data from:
@@ -37,22 +138,79 @@ class APIDataAgent:
     - a focus nutrient (e.g. 'protein', 'fiber', 'calories')
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        cache_dir: Optional[str] = "cache/api",
+        cache_ttl: int = 3600,
+        openai_client=None,
+    ):
         # Base URLs
         self.spoonacular_base = "https://api.spoonacular.com"
         self.usda_base = "https://api.nal.usda.gov/fdc"
+        self._spoon_search_url = f"{self.spoonacular_base}/recipes/complexSearch"
+        self._usda_search_url = f"{self.usda_base}/v1/foods/search"
 
         # API keys: prefer Streamlit secrets, fall back to env vars
-        self.spoonacular_key = _SECRETS.get("SPOONACULAR_API_KEY") or os.getenv(
-            "SPOONACULAR_API_KEY"
+        self.spoonacular_key = _SPOONACULAR_KEY
+        self.usda_key = _USDA_KEY
+        self.openai_key = _OPENAI_KEY
+
+        # OpenAI client for embeddings (an injected one shares its HTTP pool)
+        self._client = openai_client
+        if self._client is None and OpenAI is not None and self.openai_key:
+            self._client = _openai_client(self.openai_key)
+
+        # Recipe embeddings keyed by raw recipe id ('spoon_…' / 'usda_…');
+        # recipe texts rarely change, so only the query and unseen recipes
+        # need embedding on later calls
+        self._embed_cache: Dict[str, List[float]] = {}
+
+        # One pooled HTTP session for all providers so repeated queries reuse
+        # keep-alive TCP/TLS connections instead of re-handshaking every call
+        self._session = requests.Session()
+        self._session.mount(
+            "https://", HTTPAdapter(pool_connections=4, pool_maxsize=20)
         )
-        self.usda_key = _SECRETS.get("USDA_API_KEY") or os.getenv("USDA_API_KEY")
-        self.openai_key = _SECRETS.get("OPENAI_API_KEY") or os.getenv("OPENAI_API_KEY")
+        self._session.headers.update({"User-Agent": _USER_AGENT})
+
+        # Providers are independent I/O-bound calls, so fan them out on a
+        # small reusable pool rather than running them back to back
+        self._pool = ThreadPoolExecutor(max_workers=3)
+
+        # Parsed provider results keyed by request params, so repeated queries
+        # skip the HTTPS round-trip (and Spoonacular's daily points quota)
+        self._cache_ttl = cache_ttl
+        self._cache = None
+        if Cache is not None and cache_dir:
+            try:
+                self._cache = Cache(cache_dir)
+            except Exception as e:
+                logger.warning("Response cache disabled: %s", e)
+
+    def close(self):
+        """Release pooled HTTP connections, worker threads and the cache."""
+        self._pool.shutdown(wait=False)
+        self._session.close()
+        if self._cache is not None:
+            self._cache.close()
+
+    # ------------------------------------------------------------------
+    # Response cache
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _cache_key(provider: str, params: Dict[str, Any]) -> tuple:
+        items = sorted((k, v) for k, v in params.items() if k not in _SECRET_PARAMS)
+        return (provider, tuple(items))
+
+    def _cache_get(self, key: tuple) -> Optional[List[dict]]:
+        if self._cache is None:
+            return None
+        return self._cache.get(key)
 
-        # OpenAI client for embeddings
-        self._client = None
-        if OpenAI is not None and self.openai_key:
-            self._client = OpenAI(api_key=self.openai_key)
+    def _cache_set(self, key: tuple, results: List[dict]) -> None:
+        # Only called for successful responses; errors / 429s are never cached
+        if self._cache is not None:
+            self._cache.set(key, results, expire=self._cache_ttl)
 
     def _extract_nutrient(self, raw, nutrient_name):
         """Extract a nutrient value by name from USDA's nutrient list."""
@@ -74,7 +232,7 @@ class APIDataAgent:
         if not self.spoonacular_key:
             return []
 
-        url = f"{self.spoonacular_base}/recipes/complexSearch"
+        url = self._spoon_search_url
         params = {
             "query": query,
             "number": page_size,
@@ -84,84 +242,89 @@ class APIDataAgent:
             "apiKey": self.spoonacular_key,
         }
 
-        print(f"[SPOONACULAR] Calling {url} with params={params}")
-        resp = requests.get(url, params=params, timeout=10)
-        print(f"[SPOONACULAR] Status: {resp.status_code}")
+        cache_key = self._cache_key("spoonacular", params)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
 
-        # Handle quota / error cases explicitly
-        try:
-            resp.raise_for_status()
-            data = resp.json()
-        except Exception as e:
-            print("[SPOONACULAR] Error parsing response:", e)
-            print(resp.text[:500])
-            return []
+        logger.debug(
+            "Spoonacular %s params=%s",
+            url,
+            {k: v for k, v in params.items() if k not in _SECRET_PARAMS},
+        )
+        # Read the (gzip-decoded) body straight off the socket and hand the
+        # bytes to orjson, skipping requests' buffering and charset sniffing
+        with self._session.get(url, params=params, timeout=10, stream=True) as resp:
+            logger.debug("Spoonacular status %s", resp.status_code)
+            body = resp.raw.read(decode_content=True)
+
+            # Handle quota / error cases explicitly
+            try:
+                resp.raise_for_status()
+                data = _json_loads(body)
+            except Exception as e:
+                logger.warning(
+                    "Spoonacular error parsing response: %s %s",
+                    e,
+                    body[:500].decode("utf-8", "replace"),
+                )
+                return []
 
         # Quota exceeded message often comes back as JSON with 'message' field
         msg = (data.get("message") or "").lower() if isinstance(data, dict) else ""
         if "daily points limit" in msg:
-            print("[SPOONACULAR] Daily points limit reached.")
+            logger.warning("Spoonacular daily points limit reached.")
             return []
 
         results = data.get("results") or []
-        recipes: List[dict] = []
-
-        for r in results:
-            # Ingredients
-            ext_ings = r.get("extendedIngredients") or []
-            ingredients: List[str] = []
-            for ing in ext_ings:
-                name_clean = (
-                    ing.get("nameClean")
-                    or ing.get("original")
-                    or ing.get("name")
-                )
-                if name_clean:
-                    ingredients.append(name_clean)
+        recipes: List[dict] = [self._parse_spoonacular_recipe(r) for r in results]
 
-            # Diet tags
-            diets = r.get("diets") or []
-
-            # Nutrition
-            cal = prot = carb = fat = fiber = None
-            nutrients = (r.get("nutrition") or {}).get("nutrients") or []
-            for n in nutrients:
-                nname = (n.get("name") or "").lower()
-                val = n.get("amount")
-                if not isinstance(val, (int, float)):
-                    continue
-                if "calories" in nname:
-                    cal = val if cal is None else cal
-                elif "protein" in nname:
-                    prot = val if prot is None else prot
-                elif "carbohydrate" in nname:
-                    carb = val if carb is None else carb
-                elif "fat" in nname:
-                    fat = val if fat is None else fat
-                elif "fiber" in nname or "fibre" in nname:
-                    fiber = val if fiber is None else fiber
-
-            recipes.append(
-                {
-                    "id": f"spoon_{r.get('id')}",
-                    "name": r.get("title") or "Unknown Recipe",
-                    "ingredients": ingredients,
-                    "diets": diets,
-                    "allergens": [],
-                    "calories": cal,
-                    "protein": prot,
-                    "carbs": carb,
-                    "fat": fat,
-                    "fiber": fiber,
-                    # you prefer to use source_url rather than inline instructions
-                    "instructions": None,
-                    "source_url": r.get("sourceUrl"),
-                    "source": "spoonacular",
-                }
-            )
+        for rec in recipes:
+            rec["_search_blob"] = self._build_search_blob(rec)
+            rec["_text"] = self._build_recipe_text(rec)
 
+        self._cache_set(cache_key, recipes)
         return recipes
 
+    @staticmethod
+    def _parse_spoonacular_recipe(r: dict) -> dict:
+        """Convert one Spoonacular recipe object into a raw recipe dict."""
+        # Ingredients
+        ext_ings = r.get("extendedIngredients") or []
+        ingredients: List[str] = [
+            name
+            for name in (
+                ing.get("nameClean") or ing.get("original") or ing.get("name")
+                for ing in ext_ings
+            )
+            if name
+        ]
+
+        # Diet tags
+        diets = r.get("diets") or []
+
+        # Nutrition (first value wins per macro)
+        macros = dict.fromkeys(("calories", "protein", "carbs", "fat", "fiber"))
+        nutrients = (r.get("nutrition") or {}).get("nutrients") or []
+        for n in nutrients:
+            slot = _SPOON_NUTRIENT_MAP.get((n.get("name") or "").lower())
+            val = n.get("amount")
+            if slot and macros[slot] is None and isinstance(val, (int, float)):
+                macros[slot] = val
+
+        return {
+            "id": f"spoon_{r.get('id')}",
+            "name": r.get("title") or "Unknown Recipe",
+            "ingredients": ingredients,
+            "diets": diets,
+            "allergens": [],
+            **macros,
+            # you prefer to use source_url rather than inline instructions
+            "instructions": None,
+            "source_url": r.get("sourceUrl"),
+            "source": "spoonacular",
+        }
+
     # ------------------------------------------------------------------
     # USDA FoodData Central (optional)
     # ------------------------------------------------------------------
@@ -173,39 +336,57 @@ class APIDataAgent:
         if not self.usda_key:
             return []
 
-        url = f"{self.usda_base}/v1/foods/search"
+        url = self._usda_search_url
         params = {
             "api_key": self.usda_key,
             "query": query,
             "pageSize": page_size,
             "dataType": "Foundation,Branded",
         }
-        resp = requests.get(url, params=params, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        foods = data.get("foods") or []
+
+        cache_key = self._cache_key("usda", params)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+
+        if ijson is not None:
+            # Branded results can be multi-MB; stream one food at a time
+            # instead of materialising the whole payload, and stop early
+            with self._session.get(
+                url, params=params, timeout=10, stream=True
+            ) as resp:
+                resp.raise_for_status()
+                resp.raw.decode_content = True
+                foods = ijson.items(resp.raw, "foods.item", use_float=True)
+                results = self._parse_usda_foods(islice(foods, page_size))
+        else:
+            resp = self._session.get(url, params=params, timeout=10)
+            resp.raise_for_status()
+            data = _json_loads(resp.content)
+            results = self._parse_usda_foods(data.get("foods") or [])
+
+        for rec in results:
+            rec["_search_blob"] = self._build_search_blob(rec)
+            rec["_text"] = self._build_recipe_text(rec)
+
+        self._cache_set(cache_key, results)
+        return results
+
+    @staticmethod
+    def _parse_usda_foods(foods: Iterable[dict]) -> List[dict]:
+        """Convert USDA 'foods' entries into raw recipe dicts."""
         results: List[dict] = []
 
         for food in foods:
             desc = food.get("description") or "USDA food"
             nutrients = food.get("foodNutrients", []) or []
 
-            cal = prot = carb = fat = fiber = None
+            macros = dict.fromkeys(("calories", "protein", "carbs", "fat", "fiber"))
             for n in nutrients:
-                name = (n.get("nutrientName") or "").lower()
+                slot = _USDA_NUTRIENT_MAP.get((n.get("nutrientName") or "").lower())
                 val = n.get("value")
-                if not isinstance(val, (int, float)):
-                    continue
-                if "energy" in name or "kcal" in name:
-                    cal = val if cal is None else cal
-                elif "protein" in name:
-                    prot = val if prot is None else prot
-                elif "carbohydrate" in name:
-                    carb = val if carb is None else carb
-                elif "total lipid" in name or "fat" in name:
-                    fat = val if fat is None else fat
-                elif "fiber" in name:
-                    fiber = val if fiber is None else fiber
+                if slot and macros[slot] is None and isinstance(val, (int, float)):
+                    macros[slot] = val
 
             results.append(
                 {
@@ -214,11 +395,7 @@ class APIDataAgent:
                     "ingredients": [desc],  # single-food "recipe"
                     "diets": [],
                     "allergens": [],
-                    "calories": cal,
-                    "protein": prot,
-                    "carbs": carb,
-                    "fat": fat,
-                    "fiber": fiber,
+                    **macros,
                     "source": "usda",
                     "instructions": None,
                     "source_url": f"https://fdc.nal.usda.gov/fdc-app.html#/food/{food.get('fdcId')}",
@@ -255,6 +432,30 @@ class APIDataAgent:
             return 0.0
         return dot / (nu * nv)
 
+    @staticmethod
+    def _similarities(
+        query_vec: Optional[List[float]], recipe_vecs: List[List[float]], n: int
+    ) -> np.ndarray:
+        """
+        Cosine similarity of the query against every recipe vector at once
+        (one BLAS matrix-vector product). Recipes without a usable vector
+        score 0.0.
+        """
+        sims = np.zeros(n, dtype=np.float32)
+        if query_vec is None or not recipe_vecs:
+            return sims
+
+        dim = len(query_vec)
+        rows = [i for i, v in enumerate(recipe_vecs[:n]) if len(v) == dim]
+        if not dim or not rows:
+            return sims
+
+        q = np.asarray(query_vec, dtype=np.float32)
+        mat = np.asarray([recipe_vecs[i] for i in rows], dtype=np.float32)
+        norms = np.linalg.norm(mat, axis=1) * np.linalg.norm(q)
+        sims[rows] = (mat @ q) / (norms + 1e-12)
+        return sims
+
     # ------------------------------------------------------------------
     # Reranking helpers
     # ------------------------------------------------------------------
@@ -272,41 +473,25 @@ class APIDataAgent:
         Very simple heuristic tokeniser for potential ingredient words.
         Filters out some common non-ingredient words.
         """
-        query = query.lower()
-        tokens = [t.strip(".,!?") for t in query.split()]
-        stop = {
-            "high",
-            "low",
-            "protein",
-            "fibre",
-            "fiber",
-            "fat",
-            "carb",
-            "carbs",
-            "calorie",
-            "calories",
-            "healthy",
-            "recipe",
-            "recipes",
-            "meal",
-            "meals",
-            "for",
-            "with",
-            "and",
-            "please",
-        }
-        return [t for t in tokens if t and t not in stop]
+        tokens = [t.strip(_TOKEN_PUNCT) for t in query.lower().split()]
+        return [t for t in tokens if t and t not in _STOP_TOKENS]
+
+    @staticmethod
+    def _build_search_blob(raw: dict) -> str:
+        """
+        Lower-cased name + ingredients joined once, so coverage checks are a
+        single substring scan per token. Newline-separated so a token can
+        never match across two ingredients.
+        """
+        parts = [raw.get("name") or ""] + list(raw.get("ingredients", []))
+        return "\n".join(parts).lower()
 
     @staticmethod
     def _ingredient_coverage(raw: dict, tokens: List[str]) -> float:
         if not tokens:
             return 1.0  # no explicit ingredient hints → neutral
-        name = (raw.get("name") or "").lower()
-        ingredients = [i.lower() for i in raw.get("ingredients", [])]
-        hits = 0
-        for t in tokens:
-            if t in name or any(t in ing for ing in ingredients):
-                hits += 1
+        haystack = raw.get("_search_blob") or APIDataAgent._build_search_blob(raw)
+        hits = sum(1 for t in tokens if t in haystack)
         return hits / len(tokens)
 
     @staticmethod
@@ -353,51 +538,64 @@ class APIDataAgent:
         if not raw_results:
             return []
 
-        # Build texts for embeddings
-        recipe_texts = [self._build_recipe_text(r) for r in raw_results]
         tokens = self._extract_query_tokens(query)
-
-        # Embeddings
-        if self._client:
+        has_semantic = self._client is not None
+
+        # No rerank signal at all: every score would tie, keep API order
+        if not (has_semantic or focus_nutrient or tokens):
+            return raw_results[:top_k]
+
+        # Embeddings (only the query + recipes not seen before)
+        if has_semantic:
+            missing = [
+                idx for idx, r in enumerate(raw_results)
+                if r.get("id") not in self._embed_cache
+            ]
+            recipe_texts = [
+                raw_results[i].get("_text") or self._build_recipe_text(raw_results[i])
+                for i in missing
+            ]
             embeds = self._embed([query] + recipe_texts)
             if embeds:
                 query_vec = embeds[0]
-                recipe_vecs = embeds[1:]
+                for idx, vec in zip(missing, embeds[1:]):
+                    self._embed_cache[raw_results[idx].get("id")] = vec
+                recipe_vecs = [
+                    self._embed_cache.get(r.get("id"), []) for r in raw_results
+                ]
             else:
                 query_vec, recipe_vecs = None, []
         else:
             query_vec, recipe_vecs = None, []
 
-        scored = []
-        for idx, raw in enumerate(raw_results):
-            cov = self._ingredient_coverage(raw, tokens)
-            nutr = self._nutrient_value(raw, focus_nutrient)
-
-            # Log-scale nutrient so very high values don’t dominate
-            nutr_score = math.log(1 + max(nutr, 0)) if nutr else 0.0
-
-            if query_vec is not None and idx < len(recipe_vecs):
-                sim = self._cosine(query_vec, recipe_vecs[idx])
-            else:
-                sim = 0.0
+        n = len(raw_results)
+        sims = self._similarities(query_vec, recipe_vecs, n)
+        cov = np.fromiter(
+            (self._ingredient_coverage(r, tokens) for r in raw_results),
+            dtype=np.float64,
+            count=n,
+        )
+        nutr_vals = np.fromiter(
+            (self._nutrient_value(r, focus_nutrient) for r in raw_results),
+            dtype=np.float64,
+            count=n,
+        )
 
-            # Weighted combination
-            score = (
-                0.4 * cov +      # ingredient coverage
-                0.4 * sim +      # semantic similarity
-                0.2 * nutr_score # macro emphasis
-            )
+        # Log-scale nutrient so very high values don’t dominate
+        nutr_scores = np.log1p(np.maximum(nutr_vals, 0.0))
 
-            scored.append({
-                "score": score,
-                "nutr_value": nutr or 0.0,
-                "recipe": raw,
-            })
+        # Weighted combination
+        scores = (
+            0.4 * cov +         # ingredient coverage
+            0.4 * sims +        # semantic similarity
+            0.2 * nutr_scores   # macro emphasis
+        )
 
-        # Sort primarily by focus nutrient (descending), then by weighted score
-        scored.sort(key=lambda x: (x["nutr_value"], x["score"]), reverse=True)
+        # Sort primarily by focus nutrient (descending), then by weighted score.
+        # lexsort is stable, so negating the keys keeps API order on full ties
+        order = np.lexsort((-scores, -nutr_vals))
 
-        top = [s["recipe"] for s in scored[:top_k]]
+        top = [raw_results[i] for i in order[:top_k]]
         return top
 
     # ------------------------------------------------------------------
@@ -435,6 +633,7 @@ class APIDataAgent:
         focus_nutrient: Optional[str] = None,
         top_k: int = 30,
         include_usda: bool = False,
+        recipe_filter: Optional[Callable[[Recipe], bool]] = None,
     ) -> List[Recipe]:
         """
         High-level entry used by other agents.
@@ -444,24 +643,54 @@ class APIDataAgent:
           (e.g. 'protein', 'fiber', 'calories')
         - top_k: how many recipes to keep after reranking
         - include_usda: whether to include USDA 'foods' in the candidate pool
+        - recipe_filter: optional predicate (e.g. dietary compliance) applied
+          to each provider's batch as soon as it arrives, so rejected
+          candidates are never embedded or reranked
 
         Returns a list of Recipe objects.
         """
-        try:
-            raw: List[dict] = []
-
-            # 1. Collect raw dicts from external APIs
-            raw.extend(self._fetch_from_spoonacular(query))
-
-            if include_usda:
-                raw.extend(self._fetch_from_usda(query))
+        raw: List[dict] = []
+        errors: List[str] = []
 
-            # Guard: keep only dicts (avoid accidentally mixing in Recipe objects)
-            raw = [r for r in raw if isinstance(r, dict)]
+        # 1. Collect raw dicts from external APIs (concurrently)
+        providers = [self._fetch_from_spoonacular]
+        if include_usda:
+            providers.append(self._fetch_from_usda)
 
-            if not raw:
-                return []
+        futures = {
+            self._pool.submit(fetch, query): idx
+            for idx, fetch in enumerate(providers)
+        }
+        batches: List[List[dict]] = [[] for _ in providers]
+        for future in as_completed(futures):
+            idx = futures[future]
+            try:
+                # Guard: keep only dicts (avoid accidentally mixing in Recipe objects)
+                batch = [r for r in future.result() if isinstance(r, dict)]
+
+                # Filter this batch while the other providers are still in flight
+                if recipe_filter is not None:
+                    batch = [r for r in batch if recipe_filter(self._normalise_recipe(r))]
+            except Exception as e:
+                # One slow / failing provider (network error, malformed JSON,
+                # missing fields) must not discard the others; if none
+                # succeed, the failures are raised together as APIDataError
+                name = providers[idx].__name__
+                logger.warning("%s failed: %s", name, e)
+                errors.append(f"{name}: {e}")
+                continue
+            batches[idx] = batch
+
+        # Keep provider order stable so reranking ties stay deterministic
+        for batch in batches:
+            raw.extend(batch)
+
+        if not raw:
+            if errors:
+                raise APIDataError(f"Failed to fetch recipes: {'; '.join(errors)}")
+            return []
 
+        try:
             # 2. Rerank raw dicts
             reranked_dicts = self._rerank(query, raw, focus_nutrient, top_k)
             #print(f"[DEBUG] Query: {query}")
@@ -477,3 +706,53 @@ class APIDataAgent:
 
         except Exception as e:
             raise APIDataError(f"Failed to fetch recipes: {e}")
+
+    def fetch_by_id(self, recipe_id: str) -> Optional[Recipe]:
+        """
+        Re-hydrate a single Recipe from its id ('spoon_<id>' or 'usda_<fdcId>').
+        Returns None for unknown id formats or unconfigured providers.
+        """
+        provider, _, native_id = str(recipe_id).partition("_")
+        if not native_id:
+            return None
+
+        if provider == "spoon" and self.spoonacular_key:
+            url = f"{self.spoonacular_base}/recipes/{native_id}/information"
+            params = {"includeNutrition": True, "apiKey": self.spoonacular_key}
+            parse = self._parse_spoonacular_recipe
+        elif provider == "usda" and self.usda_key:
+            url = f"{self.usda_base}/v1/food/{native_id}"
+            params = {"api_key": self.usda_key}
+            parse = self._parse_usda_food_detail
+        else:
+            return None
+
+        cache_key = self._cache_key(f"{provider}_by_id", {"id": native_id, **params})
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return self._normalise_recipe(cached[0])
+
+        try:
+            resp = self._session.get(url, params=params, timeout=10)
+            resp.raise_for_status()
+            rec = parse(_json_loads(resp.content))
+        except Exception as e:
+            raise APIDataError(f"Failed to fetch recipe {recipe_id}: {e}")
+
+        self._cache_set(cache_key, [rec])
+        return self._normalise_recipe(rec)
+
+    @classmethod
+    def _parse_usda_food_detail(cls, food: dict) -> dict:
+        """
+        '/v1/food/{fdcId}' nests nutrient names under 'nutrient' and uses
+        'amount'; flatten to the search shape and reuse _parse_usda_foods.
+        """
+        flat = [
+            {
+                "nutrientName": (n.get("nutrient") or {}).get("name"),
+                "value": n.get("amount"),
+            }
+            for n in food.get("foodNutrients") or []
+        ]
+        return cls._parse_usda_foods([{**food, "foodNutrients": flat}])[0]
@@ -1,16 +1,133 @@
 # conversational_agent.py
 
+import atexit
+import copy
+import hashlib
 import json
+import queue
 import re
-from openai import OpenAI
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+import httpx
+import numpy as np
+from openai import APIError, OpenAI
+
+# Faster JSON encode/decode when orjson is available
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+except ImportError:
+    _json_loads = json.loads
+    _json_dumps = json.dumps
+
+# Optional on-disk cache for LLM message analysis
+try:
+    from diskcache import Cache
+except ImportError:
+    Cache = None  # type: ignore
 
 from models import UserProfile
-from api_agent import APIDataAgent
+from api_agent import APIDataAgent, APIDataError
 from dietary_agent import DietaryRestrictionAgent
 from ingredient_agent import IngredientAgent
-from objective_agent import ObjectiveAgent
+from objective_agent import ObjectiveAgent, objective_sort_key
 from memory_agent import MemoryAgent
 
+# "Clear my fridge" style commands, checked before anything else
+_CLEAR_INV_RE = re.compile(r"clear my (?:fridge|inventory)|reset inventory", re.IGNORECASE)
+
+# Index-reference patterns, compiled once at import
+_NUMBER_RE = re.compile(r"number\s+(\d+)")
+_ORD_RE = re.compile(r"\b(\d+)(st|nd|rd|th)\b")
+_DIGIT_RE = re.compile(r"\b([1-9])\b")
+
+# Short acknowledgements / "more of the same" requests that need no LLM analysis
+_FAST_INTENT_MAX_TOKENS = 6
+_FAST_INTENT_RE = re.compile(
+    r"^(?:"
+    r"(?:ok(?:ay)?|cool|great|nice|perfect|awesome|thanks?|thank you|thx|ty)"
+    r"(?:[\s,!.]+(?:thanks?|thank you|so much|a lot))*"
+    r"|got it|sounds good|"
+    r"(?:(?:show|give|suggest)(?: me)? )?(?:another|more|other|different|some more)"
+    r"(?: ones?| recipes?| options?| ideas?)?(?: please)?"
+    r"|(?:list|show(?: me)?) \d+(?: more)?(?: ones?| recipes?)?"
+    r")[\s!.?]*$"
+)
+
+# Filler phrases stripped before keyword extraction in _build_recipe_query.
+# Replaced one after another, in this order: a removal can join the text
+# around it into a later phrase ("recipesuggest" -> "recipe "), so the
+# passes are not equivalent to a single alternation.
+REMOVE_PHRASES = (
+    "i am", "i'm", "please", "can you", "could you", "suggest", "give me",
+    "recommend", "recipes", "recipe", "in my inventory", "currently have",
+    "trying to", "trying", "bulk", "cut", "lose weight", "healthy", "healthier",
+    "allergic to", "allergy", "inventory", "dietary", "preference",
+)
+_WORD_RE = re.compile(r"[a-z]+")
+STOPWORDS = frozenset({
+    "a", "an", "the", "for", "and", "with", "or", "of", "on", "in", "to", "my", "is", "am"
+})
+
+
+def _phrase_re(phrases):
+    """One alternation over `phrases`, so all are matched in a single scan."""
+    return re.compile("|".join(re.escape(p) for p in sorted(phrases, key=len, reverse=True)))
+
+
+# Keyword tables for the message heuristics, one compiled alternation each.
+# Searched without word boundaries, so a table matches exactly where the old
+# any(k in text for k in keywords) substring test did ("snacking" -> "snack")
+_DETAIL_RE = _phrase_re((
+    "recipe", "ingredients", "how do i make", "how to make", "steps", "method",
+    "instructions",
+))
+
+_FIBER_RE = _phrase_re(("fibre", "fiber"))
+_PROTEIN_RE = _phrase_re(("protein",))
+_CALORIE_RE = _phrase_re(("cutting", "calorie deficit", "low calorie", "weight loss"))
+
+_USDA_RE = _phrase_re((
+    "snack", "snacks", "protein bar", "bars", "ready to eat", "grab and go", "on the go",
+    "macros", "macro info", "nutritional info", "nutrition info", "calories",
+    "grams of protein", "macro breakdown",
+))
+
+# Message analyses memoised in-process per agent (LRU)
+_ANALYSIS_MEMO_SIZE = 1024
+
+# Combined rankings memoised per agent (LRU); above this temperature they
+# are sampled on purpose, so never cached
+_RANKING_CACHE_SIZE = 256
+_RANKING_CACHE_MAX_TEMPERATURE = 0.3
+
+# Recently recommended Recipe objects kept for detail lookups (LRU)
+_RECIPE_CACHE_SIZE = 512
+
+# Conversations whose last recommendation list is kept (LRU)
+_LAST_RECOMMENDATIONS_SIZE = 1024
+
+# Below this many recipes the builtin sort beats building a NumPy array
+_NUMPY_SORT_MIN = 100
+
+
+def _pooled_openai_client():
+    """
+    OpenAI client over a keep-alive httpx pool, so concurrent calls from the
+    worker threads reuse TCP/TLS connections instead of queueing on one.
+    """
+    return OpenAI(
+        http_client=httpx.Client(
+            limits=httpx.Limits(max_keepalive_connections=16, max_connections=32)
+        )
+    )
+
 
 class ConversationalAgent:
     """
@@ -18,41 +135,136 @@ class ConversationalAgent:
     using the Responses API (gpt-4o-mini).
     """
 
-    def __init__(self, model="gpt-4o-mini", excel_file_path="MemoryFiles/TestWorkBook.xlsx"):
-        self.client = OpenAI()
+    def __init__(
+        self,
+        model="gpt-4o-mini",
+        excel_file_path="MemoryFiles/TestWorkBook.xlsx",
+        analysis_cache_dir="cache/analysis",
+        client=None,
+    ):
+        # One pooled client shared by every LLM-backed agent
+        self.client = client or _pooled_openai_client()
         self.model = model
 
+        # In-process LRU of message analyses: (frozen profile, normalised
+        # message, temperature) -> LLM output text
+        self._analysis_memo = OrderedDict()
+        self._analysis_memo_lock = threading.Lock()
+
+        # Second-level (on-disk) cache of message analyses, so restarts keep hits
+        self._analysis_disk_cache = None
+        if Cache is not None and analysis_cache_dir:
+            try:
+                self._analysis_disk_cache = Cache(analysis_cache_dir)
+            except Exception as e:
+                print(f"[WARNING] Analysis cache disabled: {e}")
+
         # Memory / storage
         self.memory_agent = MemoryAgent(excel_file_path=excel_file_path)
 
+        # Profile saves are queued and written by a background thread, so the
+        # Excel write is off the request path. Snapshots not yet written are
+        # kept in _pending_saves and served to loads (read-your-writes).
+        self._save_queue = queue.Queue()
+        self._pending_saves = {}
+        self._pending_lock = threading.Lock()
+        self._save_thread = threading.Thread(
+            target=self._save_worker, name="memory-writer", daemon=True
+        )
+        self._save_thread.start()
+        atexit.register(self.flush_saves)
+
         # Deterministic agents
-        self.api_agent = APIDataAgent()
+        # An injected client is shared with the embeddings calls too
+        self.api_agent = APIDataAgent(openai_client=client)
         self.diet_agent = DietaryRestrictionAgent()
 
         # LLM-based agents share the same client and model
         self.ingredient_agent = IngredientAgent(client=self.client, model=self.model)
         self.objective_agent = ObjectiveAgent(client=self.client, model=self.model)
 
-        # Short-term per-user memory of last recommendations (in-process)
-        # { username: [Recipe, Recipe, ...] }
-        self.last_recommendations = {}
+        # Short-term memory of last recommendations (in-process, bounded LRU)
+        # { session_id or username: [recipe_id, recipe_id, ...] }
+        self.last_recommendations = OrderedDict()
+
+        # (payload_json, temperature) -> combined ranking output text (LRU)
+        self._ranking_cache = OrderedDict()
+        self._ranking_lock = threading.Lock()
+
+        # recipe_id -> Recipe for recently recommended recipes (bounded LRU);
+        # detail lookups fall back to APIDataAgent.fetch_by_id once evicted
+        self._recipe_cache = OrderedDict()
+        self._recipe_cache_lock = threading.Lock()
+
+    # ---------- Background profile writer ----------
+
+    def _save_profile(self, user, conversation_context=None):
+        """
+        Queue a profile save and return immediately. The returned Future
+        resolves to MemoryAgent's save result once the row is written.
+        """
+        snapshot = copy.deepcopy(user)
+        future = Future()
+        with self._pending_lock:
+            self._pending_saves[snapshot.user_id] = snapshot
+        self._save_queue.put((snapshot, conversation_context, future))
+        return future
+
+    def _load_user_profile(self, username):
+        with self._pending_lock:
+            pending = self._pending_saves.get(username)
+        if pending is not None:
+            return copy.deepcopy(pending)
+        return self.memory_agent.load_user_profile(username)
+
+    def _save_worker(self):
+        while True:
+            # Take everything queued so far; repeated saves for the same user
+            # collapse into one row update and the batch into one file write
+            batch = [self._save_queue.get()]
+            while True:
+                try:
+                    batch.append(self._save_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            latest = {}
+            for user, ctx, _ in batch:
+                latest[user.user_id] = (user, ctx)
+            try:
+                result = self.memory_agent.save_user_profiles(list(latest.values()))
+            except Exception as e:
+                result = {"status": "error", "message": str(e)}
+
+            with self._pending_lock:
+                for user_id, (user, _) in latest.items():
+                    if self._pending_saves.get(user_id) is user:
+                        del self._pending_saves[user_id]
+            for _, _, future in batch:
+                future.set_result(result)
+                self._save_queue.task_done()
+
+    def flush_saves(self):
+        """Block until every queued profile save has been written."""
+        self._save_queue.join()
 
     # ---------- Helpers for index-based references ----------
 
     def _extract_index_from_message(self, message: str):
         """
         Try to detect references like 'number 1', '1', '1st', 'first one', etc.
+        Expects the already lower-cased message.
         Returns an integer index (1-based) or None.
         """
-        msg = message.lower()
+        msg = message
 
         # Explicit "number X" pattern
-        m = re.search(r"number\s+(\d+)", msg)
+        m = _NUMBER_RE.search(msg)
         if m:
             return int(m.group(1))
 
         # 1st / 2nd / 3rd / 4th patterns
-        m = re.search(r"\b(\d+)(st|nd|rd|th)\b", msg)
+        m = _ORD_RE.search(msg)
         if m:
             return int(m.group(1))
 
@@ -69,32 +281,227 @@ class ConversationalAgent:
                 return idx
 
         # Bare single digit (avoid treating years etc. as indexes)
-        m = re.search(r"\b([1-9])\b", msg)
+        m = _DIGIT_RE.search(msg)
         if m:
             return int(m.group(1))
 
         return None
 
+    def _lookup_recipe(self, recipe_id):
+        """Recipe for a remembered id: live object if any, else re-fetched."""
+        with self._recipe_cache_lock:
+            recipe = self._recipe_cache.get(recipe_id)
+            if recipe is not None:
+                self._recipe_cache.move_to_end(recipe_id)
+                return recipe
+        try:
+            recipe = self.api_agent.fetch_by_id(recipe_id)
+        except APIDataError as e:
+            print(f"[WARNING] Could not re-fetch recipe {recipe_id}: {e}")
+            return None
+        if recipe is not None:
+            self._remember_recipes([recipe])
+        return recipe
+
+    def _remember_recipes(self, recipes):
+        with self._recipe_cache_lock:
+            for r in recipes:
+                self._recipe_cache[r.id] = r
+                self._recipe_cache.move_to_end(r.id)
+            while len(self._recipe_cache) > _RECIPE_CACHE_SIZE:
+                self._recipe_cache.popitem(last=False)
+
+    def _remember_last_list(self, key, recipe_ids):
+        with self._recipe_cache_lock:
+            self.last_recommendations[key] = recipe_ids
+            self.last_recommendations.move_to_end(key)
+            while len(self.last_recommendations) > _LAST_RECOMMENDATIONS_SIZE:
+                self.last_recommendations.popitem(last=False)
+
     def _is_detail_request(self, message: str) -> bool:
         """
         Heuristic: decide whether the user is asking for details of a specific recipe
-        rather than new suggestions.
-        """
-        msg = message.lower()
-        keywords = [
-            "recipe",
-            "ingredients",
-            "how do i make",
-            "how to make",
-            "steps",
-            "method",
-            "instructions",
-        ]
-        return any(k in msg for k in keywords)
+        rather than new suggestions. Expects the already lower-cased message.
+        """
+        return _DETAIL_RE.search(message) is not None
 
     # ---------- LLM: interpret user message ----------
 
-    def _analyse_message_with_llm(self, user, message, temperature=0.2):
+    @staticmethod
+    def _output_text(response):
+        """Plain text of the first output item of a Responses API response."""
+        output = response.output[0]
+        text_chunks = []
+        for c in output.content:
+            if c.type == "output_text":
+                text_chunks.append(c.text)
+        return "".join(text_chunks).strip()
+
+    @staticmethod
+    def _output_text_from_body(body):
+        """Same as _output_text, for a response body decoded from Batch API output."""
+        outputs = body.get("output") or [{}]
+        text_chunks = []
+        for c in outputs[0].get("content") or []:
+            if c.get("type") == "output_text":
+                text_chunks.append(c.get("text", ""))
+        return "".join(text_chunks).strip()
+
+    def _default_analysis(self, user, message):
+        return {
+            "objective": user.objective,
+            "dietary_restrictions": list(user.dietary_restrictions),
+            "allergies": list(user.allergies),
+            "likes": list(user.likes),
+            "dislikes": list(user.dislikes),
+            "inventory": list(user.inventory),
+            "wants_meal_plan": False,
+            "time_horizon": None,
+            "query": message,
+        }
+
+    @staticmethod
+    def _frozen_user_context(user):
+        """
+        Profile context for the analysis prompt as a hashable, key-ordered
+        tuple; built once per message and reused as the cache key.
+        """
+        return (
+            ("existing_allergies", tuple(sorted(user.allergies))),
+            ("existing_dietary_restrictions", tuple(sorted(user.dietary_restrictions))),
+            ("existing_dislikes", tuple(sorted(user.dislikes))),
+            ("existing_inventory", tuple(sorted(user.inventory))),
+            ("existing_likes", tuple(sorted(user.likes))),
+            ("objective", user.objective),
+        )
+
+    @staticmethod
+    def _thaw_user_context(frozen_user):
+        return {k: list(v) if isinstance(v, tuple) else v for k, v in frozen_user}
+
+    def _analysis_request(self, user, message, temperature=0.0):
+        """Responses API request body, shared by the sync and Batch API paths."""
+        return self._analysis_body(
+            self._thaw_user_context(self._frozen_user_context(user)), message, temperature
+        )
+
+    def _analysis_body(self, current_user, message, temperature):
+        return {
+            "model": self.model,
+            "input": [
+                {
+                    "role": "system",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": (
+                                "You are an assistant that interprets a user's free-text request "
+                                "about food and meal planning. You must output ONLY valid JSON. "
+                                "Infer their objective (cutting, bulking, healthier if possible), "
+                                "dietary restrictions, allergies, likes, dislikes, and whether "
+                                "they want a meal plan for a day or a week. "
+                                "Also extract an 'inventory' list of all items the user says they "
+                                "currently have in their fridge or pantry. "
+                                "Provide a concise 'query' string summarising what kind of recipes "
+                                "to search for (e.g. 'high protein vegan dinners with chickpeas')."
+                            ),
+                        }
+                    ],
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": _json_dumps({
+                                "message": message,
+                                "current_user": current_user,
+                            }),
+                        }
+                    ],
+                },
+            ],
+            # JSON mode: the output is always a parseable JSON object
+            "text": {"format": {"type": "json_object"}},
+            "temperature": temperature,
+        }
+
+    @staticmethod
+    def _try_fast_intent(message, default_result):
+        """
+        Keyword/regex classifier for short messages such as 'thanks',
+        'show me another' or 'list 3'. Returns the profile-derived default
+        analysis on a hit (no LLM call), else None.
+        """
+        text = message.strip().lower()
+        if not text or len(text.split()) >= _FAST_INTENT_MAX_TOKENS:
+            return None
+        if _FAST_INTENT_RE.match(text):
+            return default_result
+        return None
+
+    @staticmethod
+    def _parse_json_object(content):
+        """Decoded LLM reply, or None if it is not a JSON object."""
+        try:
+            data = _json_loads(content)
+        except (TypeError, ValueError):
+            return None
+        return data if isinstance(data, dict) else None
+
+    def _cached_analysis(self, frozen_user, message, temperature):
+        """
+        Parsed LLM analysis for a (profile snapshot, message) pair, or None
+        if the model's reply was not a JSON object. The cache key uses the
+        stripped, lower-cased message, but the model always sees the original
+        text. Memoised in-process by a bounded per-agent LRU and on disk by a
+        blake2b-keyed cache; only replies that parse are cached, and failed
+        calls raise, so neither is ever replayed.
+        """
+        key = (frozen_user, message.strip().lower(), temperature)
+        with self._analysis_memo_lock:
+            content = self._analysis_memo.get(key)
+            if content is not None:
+                self._analysis_memo.move_to_end(key)
+
+        disk_key = hashlib.blake2b(
+            repr((self.model,) + key).encode("utf-8"),
+            digest_size=16,
+        ).hexdigest()
+        if content is None and self._analysis_disk_cache is not None:
+            content = self._analysis_disk_cache.get(disk_key)
+
+        # Parsed afresh on every hit, so callers get their own dict to mutate
+        data = self._parse_json_object(content) if content is not None else None
+        if data is None:
+            current_user = self._thaw_user_context(frozen_user)
+            response = self.client.responses.create(
+                **self._analysis_body(current_user, message, temperature)
+            )
+            content = self._output_text(response)
+            data = self._parse_json_object(content)
+            if data is None:
+                return None
+
+            if self._analysis_disk_cache is not None:
+                self._analysis_disk_cache.set(disk_key, content)
+
+        with self._analysis_memo_lock:
+            self._analysis_memo[key] = content
+            while len(self._analysis_memo) > _ANALYSIS_MEMO_SIZE:
+                self._analysis_memo.popitem(last=False)
+        return data
+
+    @staticmethod
+    def _fill_analysis_defaults(data, default_result):
+        # Fill any missing keys with defaults
+        for key, value in default_result.items():
+            if key not in data or data[key] is None:
+                data[key] = value
+
+        return data
+
+    def _analyse_message_with_llm(self, user, message, temperature=0.0, frozen_user=None):
         """
         Ask gpt-4o-mini (Responses API) to extract structured info from the message.
 
@@ -112,83 +519,31 @@ class ConversationalAgent:
         }
         """
 
-        current_user = {
-            "existing_dietary_restrictions": sorted(list(user.dietary_restrictions)),
-            "existing_allergies": sorted(list(user.allergies)),
-            "existing_likes": sorted(list(user.likes)),
-            "existing_dislikes": sorted(list(user.dislikes)),
-            "existing_inventory": sorted(list(user.inventory)),
-            "objective": user.objective,
-        }
+        default_result = self._default_analysis(user, message)
 
-        default_result = {
-            "objective": user.objective,
-            "dietary_restrictions": list(user.dietary_restrictions),
-            "allergies": list(user.allergies),
-            "likes": list(user.likes),
-            "dislikes": list(user.dislikes),
-            "inventory": list(user.inventory),
-            "wants_meal_plan": False,
-            "time_horizon": None,
-            "query": message,
-        }
+        # Trivial follow-ups carry nothing the LLM could extract
+        fast = self._try_fast_intent(message, default_result)
+        if fast is not None:
+            return fast
 
-        try:
-            response = self.client.responses.create(
-                model=self.model,
-                input=[
-                    {
-                        "role": "system",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": (
-                                    "You are an assistant that interprets a user's free-text request "
-                                    "about food and meal planning. You must output ONLY valid JSON. "
-                                    "Infer their objective (cutting, bulking, healthier if possible), "
-                                    "dietary restrictions, allergies, likes, dislikes, and whether "
-                                    "they want a meal plan for a day or a week. "
-                                    "Also extract an 'inventory' list of all items the user says they "
-                                    "currently have in their fridge or pantry. "
-                                    "Provide a concise 'query' string summarising what kind of recipes "
-                                    "to search for (e.g. 'high protein vegan dinners with chickpeas')."
-                                ),
-                            }
-                        ],
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": json.dumps({
-                                    "message": message,
-                                    "current_user": current_user,
-                                }),
-                            }
-                        ],
-                    },
-                ],
-                temperature=temperature,
-            )
+        # Hashable snapshot of the profile context (the cache key)
+        if frozen_user is None:
+            frozen_user = self._frozen_user_context(user)
 
-            output = response.output[0]
-            text_chunks = []
-            for c in output.content:
-                if c.type == "output_text":
-                    text_chunks.append(c.text)
-            content = "".join(text_chunks).strip()
-            data = json.loads(content)
-        except Exception:
-            data = default_result
+        # Request failures (rate limits, timeouts, dropped connections) and
+        # replies that are not a JSON object (e.g. truncated output) fall
+        # back to the default analysis
+        try:
+            data = self._cached_analysis(frozen_user, message, temperature)
+        except (APIError, httpx.HTTPError) as e:
+            print(f"[WARNING] Message analysis failed, using defaults: {e}")
+            return default_result
+        if data is None:
+            print("[WARNING] Message analysis was not a JSON object, using defaults")
+            return default_result
 
-        # Fill any missing keys with defaults
-        for key, value in default_result.items():
-            if key not in data or data[key] is None:
-                data[key] = value
+        return self._fill_analysis_defaults(data, default_result)
 
-        return data
-    
     def _build_recipe_query(self, analysis: dict, message: str) -> str | None:
         """
         Build a concise query string suitable for external recipe APIs.
@@ -200,7 +555,8 @@ class ConversationalAgent:
         """
 
         # 1. Use inventory if present
-        inv_list = [i.strip() for i in analysis.get("inventory", []) if i and i.strip()]
+        # (sorted so the same pantry always yields the same query string)
+        inv_list = sorted({i.strip() for i in analysis.get("inventory", []) if i and i.strip()})
         if inv_list:
             return ", ".join(inv_list)
 
@@ -208,21 +564,12 @@ class ConversationalAgent:
         text = message.lower()
 
         # Remove common phrases that add no query value
-        remove_phrases = [
-            "i am", "i'm", "please", "can you", "could you", "suggest", "give me",
-            "recommend", "recipes", "recipe", "in my inventory", "currently have",
-            "trying to", "trying", "bulk", "cut", "lose weight", "healthy", "healthier",
-            "allergic to", "allergy", "inventory", "dietary", "preference"
-        ]
-        for phrase in remove_phrases:
+        for phrase in REMOVE_PHRASES:
             text = text.replace(phrase, " ")
 
-        tokens = re.findall(r"[a-z]+", text)
-        stopwords = {
-            "a", "an", "the", "for", "and", "with", "or", "of", "on", "in", "to", "my", "is", "am"
-        }
+        tokens = _WORD_RE.findall(text)
 
-        keywords = [t for t in tokens if t not in stopwords]
+        keywords = [t for t in tokens if t not in STOPWORDS]
 
         # Only keep concise, content-heavy terms
         if len(keywords) >= 2:
@@ -235,17 +582,10 @@ class ConversationalAgent:
         if analysis.get("objective"):
             user.objective = analysis["objective"]
 
-        for r in analysis.get("dietary_restrictions", []):
-            user.dietary_restrictions.add(r)
-
-        for a in analysis.get("allergies", []):
-            user.allergies.add(a)
-
-        for item in analysis.get("likes", []):
-            user.likes.add(item)
-
-        for item in analysis.get("dislikes", []):
-            user.dislikes.add(item)
+        user.dietary_restrictions.update(analysis.get("dietary_restrictions", ()))
+        user.allergies.update(analysis.get("allergies", ()))
+        user.likes.update(analysis.get("likes", ()))
+        user.dislikes.update(analysis.get("dislikes", ()))
 
         # --- INVENTORY UPDATE ---
         # If new inventory is mentioned, replace old one completely (snapshot approach)
@@ -254,6 +594,185 @@ class ConversationalAgent:
 
         return user
 
+    # ---------- LLM: combined ingredient + objective ranking ----------
+
+    def _build_combined_payload(self, recipes, user):
+        # Recipes are sent once, keyed by their position (short, stable ids)
+        recipe_summaries = [
+            {
+                "id": idx,
+                "name": r.name,
+                "ingredients": sorted(r.ingredients),
+                "calories": r.calories,
+                "protein": r.protein,
+                "carbs": r.carbs,
+                "fat": r.fat,
+            }
+            for idx, r in enumerate(recipes)
+        ]
+        user_info = {
+            "objective": user.objective or "healthier",
+            "likes": sorted(user.likes),
+            "dislikes": sorted(user.dislikes),
+            "inventory": sorted(user.inventory),
+        }
+        return {"user": user_info, "recipes": recipe_summaries}
+
+    def _combined_ranking_request(self, payload, temperature):
+        """
+        Responses API request body, shared by the sync and Batch API paths.
+        Objectives with a local sort key ('cutting', 'bulking', ...) only ask
+        for the ingredient ranking; see _order_for_objective.
+        """
+        if objective_sort_key(payload["user"]["objective"]) is not None:
+            instructions = (
+                "You are a nutrition-aware assistant that ranks recipes by the user's "
+                "ingredient preferences and pantry. Prefer recipes that contain more "
+                "liked ingredients, avoid disliked ingredients, and use ingredients "
+                "already in the user's inventory where possible.\n\n"
+                "Return ONLY valid JSON with the key 'ingredient_ranked', a list of "
+                "recipe ids (integers) ordered from best to worst."
+            )
+        else:
+            instructions = (
+                "You are a nutrition-aware assistant that ranks recipes twice.\n"
+                "1) 'ingredient_ranked': by the user's ingredient preferences and "
+                "pantry. Prefer recipes that contain more liked ingredients, avoid "
+                "disliked ingredients, and use ingredients already in the user's "
+                "inventory where possible.\n"
+                "2) 'objective_ranked': by the user's high-level objective.\n"
+                "- If objective is 'cutting' or 'fat loss', prefer lower-calorie meals "
+                "with reasonable protein.\n"
+                "- If objective is 'bulking' or 'muscle gain', prefer higher-calorie "
+                "and high-protein meals.\n"
+                "- If objective is 'healthier' or unspecified, prefer moderate calories, "
+                "decent protein, and not excessive fat.\n\n"
+                "Return ONLY valid JSON with keys 'ingredient_ranked' and "
+                "'objective_ranked', each a list of recipe ids (integers) ordered "
+                "from best to worst."
+            )
+        return {
+            "model": self.model,
+            "input": [
+                {
+                    "role": "system",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": instructions,
+                        }
+                    ],
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": _json_dumps(payload),
+                        }
+                    ],
+                },
+            ],
+            "temperature": temperature,
+        }
+
+    def _call_llm_for_combined_ranking(self, payload, temperature):
+        """
+        Ranking output text for `payload`. Identical (user, recipes) payloads
+        at low temperature are served from a per-agent LRU; only replies that
+        parse are cached, and failed calls raise, so neither is replayed.
+        """
+        if temperature > _RANKING_CACHE_MAX_TEMPERATURE:
+            return self._request_combined_ranking(payload, temperature)
+
+        key = (_json_dumps(payload), temperature)
+        with self._ranking_lock:
+            content = self._ranking_cache.get(key)
+            if content is not None:
+                self._ranking_cache.move_to_end(key)
+                return content
+
+        content = self._request_combined_ranking(payload, temperature)
+        if self._parse_json_object(content) is not None:
+            with self._ranking_lock:
+                self._ranking_cache[key] = content
+                while len(self._ranking_cache) > _RANKING_CACHE_SIZE:
+                    self._ranking_cache.popitem(last=False)
+        return content
+
+    def _request_combined_ranking(self, payload, temperature):
+        response = self.client.responses.create(
+            **self._combined_ranking_request(payload, temperature)
+        )
+        return self._output_text(response)
+
+    @staticmethod
+    def _merge_combined_ranking(recipes, content, top_k, use_objective=True):
+        """
+        Map the model's index rankings back to Recipe objects, matching the
+        two-step pipeline: objective ranking first, then the ingredient
+        ranking for anything it omitted, then input order. With
+        use_objective=False (objectives sorted locally, see
+        _order_for_objective) only the ingredient ranking is used.
+        """
+        try:
+            data = _json_loads(content)
+            ingredient_ranked = data.get("ingredient_ranked", [])
+            objective_ranked = data.get("objective_ranked", []) if use_objective else []
+        except Exception:
+            # Fallback: keep original order if parsing or API fails
+            ingredient_ranked, objective_ranked = [], []
+
+        ranked_recipes = []
+        seen = set()
+        for idx in [*objective_ranked, *ingredient_ranked, *range(len(recipes))]:
+            if type(idx) is int and 0 <= idx < len(recipes) and idx not in seen:
+                seen.add(idx)
+                ranked_recipes.append(recipes[idx])
+
+        return ranked_recipes[:top_k]
+
+    def rank_combined(self, recipes, user, top_k=10, temperature=0.2):
+        """
+        Rank recipes by ingredients and by objective in ONE LLM call
+        (replaces IngredientAgent.recommend followed by ObjectiveAgent.recommend).
+
+        Expected JSON from the model:
+
+        {
+          "ingredient_ranked": [2, 0, 1, ...],
+          "objective_ranked": [0, 2, ...]
+        }
+        """
+        if not recipes:
+            return []
+
+        payload = self._build_combined_payload(recipes, user)
+
+        try:
+            content = self._call_llm_for_combined_ranking(payload, temperature)
+        except Exception:
+            content = ""
+
+        ranked = self._merge_combined_ranking(
+            recipes, content, top_k,
+            use_objective=objective_sort_key(user.objective) is None,
+        )
+        return self._order_for_objective(ranked, user)
+
+    @staticmethod
+    def _order_for_objective(ranked, user):
+        """
+        For 'cutting'/'bulking' (and synonyms) the objective step is a plain
+        sort on the numbers: the model picks the shortlist by ingredients
+        alone and it is ordered here, like the old ingredient-then-objective
+        pipeline, instead of by a second LLM ranking.
+        """
+        goal_key = objective_sort_key(user.objective)
+        if goal_key is None:
+            return ranked
+        return sorted(ranked, key=goal_key)
+
     # ---------- Macro / nutrient focus inference ----------
 
     def _infer_focus_nutrient(self, message: str, analysis: dict):
@@ -263,13 +782,13 @@ class ConversationalAgent:
         """
         text = (message + " " + str(analysis.get("objective") or "")).lower()
 
-        if "fibre" in text or "fiber" in text:
+        if _FIBER_RE.search(text):
             return "fiber"
 
-        if "protein" in text or "high protein" in text:
+        if _PROTEIN_RE.search(text):
             return "protein"
 
-        if any(word in text for word in ["cutting", "calorie deficit", "low calorie", "weight loss"]):
+        if _CALORIE_RE.search(text):
             return "calories"
 
         obj = (analysis.get("objective") or "").lower()
@@ -298,15 +817,27 @@ class ConversationalAgent:
         if not field:
             return recipes
 
-        return sorted(
-            recipes,
-            key=lambda r: getattr(r, field, 0) or 0.0,
-            reverse=True,
+        if len(recipes) < _NUMPY_SORT_MIN:
+            return sorted(
+                recipes,
+                key=lambda r: getattr(r, field, 0) or 0.0,
+                reverse=True,
+            )
+
+        values = np.fromiter(
+            (getattr(r, field, 0) or 0.0 for r in recipes),
+            dtype=np.float64,
+            count=len(recipes),
         )
+        # Stable on the negated values == sorted(..., reverse=True) tie order
+        order = np.argsort(-values, kind="stable")
+        return [recipes[i] for i in order]
 
     # ---------- Orchestration + Memory ----------
 
-    def handle_message(self, username, message, temperature=0.2, extra_inventory=None):
+    def handle_message(
+        self, username, message, temperature=0.2, extra_inventory=None, session_id=None
+    ):
         """
         Main entry point for the app.
 
@@ -314,40 +845,52 @@ class ConversationalAgent:
 
         A) Detail mode:
            - If the user refers to 'number 1' / 'first one' etc., and
-             we have last_recommendations[username],
+             we have last_recommendations[session_id or username],
              we directly return that specific recipe (no new retrieval).
 
         B) Normal mode:
            - Full analysis → retrieval → dietary filter → LLM ranking.
 
+        `extra_inventory` may be a list or a Future of one (e.g. a fridge-photo
+        vision call still in flight); a Future is only waited on after the
+        message analysis, so the two overlap.
+
+        `session_id` keys the last-recommendations list, so one agent can
+        serve several conversations for the same user; defaults to username.
+
         Returns:
           final_recipes, analysis, updated_user, save_result
+          (save_result is a Future; the profile is written in the background)
         """
 
-         # 0. Clear-inventory command (before anything else)
-        if any(phrase in message.lower() for phrase in ["clear my fridge", "clear my inventory", "reset inventory"]):
-            user = self.memory_agent.load_user_profile(username)
+        # 0. Clear-inventory command (before anything else)
+        if _CLEAR_INV_RE.search(message):
+            user = self._load_user_profile(username)
             if user is None:
                 user = UserProfile(user_id=username, name=username)
 
             user.inventory = []
-            save_result = self.memory_agent.save_user_profile(
+            save_result = self._save_profile(
                 user, conversation_context="INVENTORY_CLEARED"
             )
 
             print(f"[INFO] Cleared inventory for user {username}")
             return [], {"action": "inventory_cleared"}, user, save_result        
         # 1. Load or create user profile
-        user = self.memory_agent.load_user_profile(username)
+        user = self._load_user_profile(username)
         if user is None:
             user = UserProfile(user_id=username, name=username)
 
         # 1a. Check if this is a detail request referring to previous list
-        last_list = self.last_recommendations.get(username, [])
-        idx = self._extract_index_from_message(message)
-        if last_list and idx is not None and 1 <= idx <= len(last_list) and self._is_detail_request(message):
-            selected = last_list[idx - 1]
-
+        conversation = session_id or username
+        last_list = self.last_recommendations.get(conversation, [])
+        msg_lower = message.lower()
+        idx = self._extract_index_from_message(msg_lower)
+        selected = None
+        if last_list and idx is not None and 1 <= idx <= len(last_list) and self._is_detail_request(msg_lower):
+            selected = self._lookup_recipe(last_list[idx - 1])
+
+        if selected is not None:
             # Build a minimal analysis payload so the UI can see what happened
             analysis = {
                 "mode": "detail",
@@ -357,7 +900,7 @@ class ConversationalAgent:
 
             # Save to Excel memory
             conv_context = "DETAIL_REQUEST: index {} -> {}".format(idx, selected.name)
-            save_result = self.memory_agent.save_user_profile(
+            save_result = self._save_profile(
                 user, conversation_context=conv_context
             )
 
@@ -365,31 +908,67 @@ class ConversationalAgent:
             final_recipes = [selected]
 
             # Keep last_recommendations as they are, so user can still refer to 2, 3, etc.
-            self.last_recommendations[username] = last_list
+            self._remember_last_list(conversation, last_list)
 
             return final_recipes, analysis, user, save_result
 
         # 2. Normal mode: interpret message with LLM
-        analysis = self._analyse_message_with_llm(user, message, temperature=temperature)
+        #    (profile context is sorted/frozen once here; extraction always
+        #    runs at temperature 0, `temperature` is for ranking)
+        frozen_user = self._frozen_user_context(user)
+        inventory_future = None
+        if isinstance(extra_inventory, Future):
+            inventory_future, extra_inventory = extra_inventory, None
+        analysis = self._analyse_message_with_llm(user, message, frozen_user=frozen_user)
+        if inventory_future is not None:
+            extra_inventory = inventory_future.result()
 
         # 2a. Merge extra_inventory (from fridge image) into analysis["inventory"]
         if extra_inventory:
             existing_inventory = analysis.get("inventory") or []
-            merged_inventory = list({*existing_inventory, *extra_inventory})
+            merged_inventory = list(set().union(existing_inventory, extra_inventory))
             analysis["inventory"] = merged_inventory
 
         # 3. Update user profile from analysis (including merged inventory)
         user = self._update_user_profile_from_analysis(user, analysis)
 
-        # 4. Build a query and infer nutrient focus
-        query = self._build_recipe_query(analysis, message)
+        # 4-6. Build a query, fetch candidates and apply dietary filters
+        query, compliant_recipes = self._retrieve_candidates(user, analysis, message)
         if not query:
             print("[WARNING] No valid query could be formed from user input.")
-            save_result = self.memory_agent.save_user_profile(
+            save_result = self._save_profile(
                 user, conversation_context="NO_VALID_QUERY"
             )
             return [], analysis, user, save_result
 
+        if not compliant_recipes:
+            return self._finish_recommendation(conversation, user, analysis, [])
+
+        # 7. Rank by ingredients + objective (one LLM call)
+        final_recipes = self.rank_combined(
+            compliant_recipes,
+            user,
+            top_k=10,
+            temperature=temperature,
+        )
+        print(f"[DEBUG] final_recipes: {len(final_recipes)}")
+
+        # 8-10. Sort, save and remember the recommendations
+        return self._finish_recommendation(conversation, user, analysis, final_recipes)
+
+    def _retrieve_candidates(self, user, analysis, message):
+        """
+        Steps 4-6 of the pipeline: build a query, infer the nutrient focus,
+        fetch candidates and apply dietary restrictions / allergies.
+
+        Returns (query, compliant_recipes); query is None if no query could
+        be formed.
+        """
+        # 4. Build a query and infer nutrient focus
+        query = self._build_recipe_query(analysis, message)
+        if not query:
+            return None, []
+
         focus_nutrient = self._infer_focus_nutrient(message, analysis)
         analysis["focus_nutrient"] = focus_nutrient
         include_usda = self._wants_usda_snacks_or_macros(message, analysis)
@@ -400,75 +979,173 @@ class ConversationalAgent:
             focus_nutrient=focus_nutrient,
             top_k=30,
             include_usda=include_usda,
+            recipe_filter=self.diet_agent.compile_filter(user),
         )
         print(f"[DEBUG] all_recipes: {len(all_recipes)}")
 
-        # 6. Apply dietary restrictions and allergies (deterministic)
+        # 6. Apply dietary restrictions and allergies (deterministic); batches
+        #    were already filtered as they arrived, so this pass is cheap and
+        #    keeps the per-recipe explanations of the debug path
         compliant_recipes = self.diet_agent.filter_recipes(all_recipes, user)
         print(f"[DEBUG] compliant_recipes: {len(compliant_recipes)}")
-        if not compliant_recipes:
-            conv_context = "ANALYSIS: " + json.dumps(analysis)
-            save_result = self.memory_agent.save_user_profile(
-                user, conversation_context=conv_context
-            )
-            self.last_recommendations[username] = []
-            return [], analysis, user, save_result
+        return query, compliant_recipes
 
-        # 7. Rank by ingredients (LLM)
-        ingredient_ranked = self.ingredient_agent.recommend(
-            compliant_recipes,
-            user,
-            top_k=50,
-            temperature=temperature,
+    def _finish_recommendation(self, conversation, user, analysis, final_recipes):
+        """
+        Steps 8-10: enforce nutrient order, save the profile + conversation
+        summary, and remember the list for detail follow-ups.
+        """
+        # 8. Enforce descending nutrient order on the final list
+        final_recipes = self._sort_by_focus_nutrient(
+            final_recipes, analysis.get("focus_nutrient")
         )
-        print(f"[DEBUG] ingredient_ranked: {len(ingredient_ranked)}")
 
-        # 8. Rank by objective (LLM)
-        final_recipes = self.objective_agent.recommend(
-            ingredient_ranked,
-            user,
-            top_k=10,
-            temperature=temperature,
+        # 9. Save updated user profile + conversation summary
+        conv_context = "ANALYSIS: " + _json_dumps(analysis)
+        save_result = self._save_profile(
+            user, conversation_context=conv_context
         )
-        print(f"[DEBUG] final_recipes: {len(final_recipes)}")
 
-        # 9. Enforce descending nutrient order on the final list
-        final_recipes = self._sort_by_focus_nutrient(final_recipes, focus_nutrient)
+        # 10. Store final_recipes as last recommendations for this conversation
+        #     (ids only; the Recipe objects are kept in _recipe_cache)
+        self._remember_recipes(final_recipes)
+        self._remember_last_list(conversation, [r.id for r in final_recipes])
 
-        # 10. Save updated user profile + conversation summary
-        conv_context = "ANALYSIS: " + json.dumps(analysis)
-        save_result = self.memory_agent.save_user_profile(
-            user, conversation_context=conv_context
+        return final_recipes, analysis, user, save_result
+
+    # ---------- Bulk (Batch API) orchestration ----------
+
+    def _run_batch(self, bodies, poll_interval=10.0):
+        """
+        Submit Responses API request bodies through the OpenAI Batch API and
+        block until the batch finishes. Returns the output text per body, in
+        order (None for requests that failed).
+        """
+        if not bodies:
+            return []
+
+        lines = [
+            _json_dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/responses",
+                "body": body,
+            })
+            for i, body in enumerate(bodies)
+        ]
+        batch_file = self.client.files.create(
+            file=("requests.jsonl", "\n".join(lines).encode("utf-8")),
+            purpose="batch",
+        )
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/responses",
+            completion_window="24h",
         )
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(poll_interval)
+            batch = self.client.batches.retrieve(batch.id)
+
+        contents = [None] * len(bodies)
+        if batch.output_file_id:
+            output = self.client.files.content(batch.output_file_id).text
+            for line in output.splitlines():
+                if not line.strip():
+                    continue
+                item = _json_loads(line)
+                body = (item.get("response") or {}).get("body") or {}
+                contents[int(item["custom_id"])] = self._output_text_from_body(body)
+        return contents
+
+    def handle_messages_bulk(self, requests, temperature=0.2, poll_interval=10.0):
+        """
+        Non-interactive counterpart of handle_message for many
+        (username, message) pairs, e.g. nightly meal-plan regeneration.
 
-        # 11. Store final_recipes as last recommendations for this user
-        self.last_recommendations[username] = list(final_recipes)
+        The LLM work goes through the Batch API (cheaper, higher throughput)
+        in two rounds instead of in-process calls: one for message analysis,
+        one for combined ranking. Detail / clear-inventory shortcuts are not
+        applied.
+
+        Returns a list of (final_recipes, analysis, updated_user, save_result),
+        in input order.
+        """
+        users = []
+        for username, _ in requests:
+            user = self._load_user_profile(username)
+            users.append(user or UserProfile(user_id=username, name=username))
+
+        # Round 1: message analysis
+        contents = self._run_batch(
+            [
+                self._analysis_request(user, message)
+                for user, (_, message) in zip(users, requests)
+            ],
+            poll_interval=poll_interval,
+        )
+
+        results = [None] * len(requests)
+        pending = []  # (index, analysis, compliant_recipes)
+        for i, ((username, message), user, content) in enumerate(zip(requests, users, contents)):
+            default_result = self._default_analysis(user, message)
+            data = self._parse_json_object(content)
+            if data is None:
+                data = default_result
+            analysis = self._fill_analysis_defaults(data, default_result)
+            user = self._update_user_profile_from_analysis(user, analysis)
+            users[i] = user
+
+            query, compliant_recipes = self._retrieve_candidates(user, analysis, message)
+            if not query:
+                save_result = self._save_profile(
+                    user, conversation_context="NO_VALID_QUERY"
+                )
+                results[i] = ([], analysis, user, save_result)
+            elif not compliant_recipes:
+                results[i] = self._finish_recommendation(username, user, analysis, [])
+            else:
+                pending.append((i, analysis, compliant_recipes))
+
+        # Round 2: combined ingredient + objective ranking
+        contents = self._run_batch(
+            [
+                self._combined_ranking_request(
+                    self._build_combined_payload(compliant_recipes, users[i]), temperature
+                )
+                for i, _, compliant_recipes in pending
+            ],
+            poll_interval=poll_interval,
+        )
+        for (i, analysis, compliant_recipes), content in zip(pending, contents):
+            final_recipes = self._order_for_objective(
+                self._merge_combined_ranking(
+                    compliant_recipes, content, top_k=10,
+                    use_objective=objective_sort_key(users[i].objective) is None,
+                ),
+                users[i],
+            )
+            results[i] = self._finish_recommendation(
+                requests[i][0], users[i], analysis, final_recipes
+            )
+
+        return results
 
-        return final_recipes, analysis, user, save_result
     # -------------------------------------------------------------
     # Memory wrappers (so example_usage.py can call them)
     # -------------------------------------------------------------
     def get_user_history(self, username: str):
         if not self.memory_agent:
             return {"status": "error", "message": "Memory agent not initialized."}
+        self.flush_saves()
         return self.memory_agent.get_user_history(username)
 
     def list_all_users(self):
         if not self.memory_agent:
             return []
+        self.flush_saves()
         return self.memory_agent.list_all_users()
 
     def _wants_usda_snacks_or_macros(self, message: str, analysis: dict) -> bool:
         text = (message + " " + str(analysis.get("objective") or "")).lower()
 
-        snack_words = [
-            "snack", "snacks", "protein bar", "bars",
-            "ready to eat", "grab and go", "on the go"
-        ]
-        macro_words = [
-            "macros", "macro info", "nutritional info",
-            "nutrition info", "calories", "grams of protein",
-            "macro breakdown"
-        ]
-
-        return any(w in text for w in snack_words + macro_words)
+        return _USDA_RE.search(text) is not None
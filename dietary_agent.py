@@ -1,4 +1,33 @@
-from models import Recipe, UserProfile
+import functools
+import sys
+
+from models import (
+    DIET_BITS, Recipe, UserProfile, allergen_mask, normalise_tag, normalised_tags,
+)
+
+
+# Canonical mapping for common restriction labels. Keys and values are
+# interned so set / dict probes on these tags can short-circuit on identity.
+_CANON = {
+    sys.intern(k): sys.intern(v)
+    for k, v in {
+        # gluten-related
+        "gluten-free": "gluten free",
+        "gluten free": "gluten free",
+        "celiac": "gluten free",
+        "celiac disease": "gluten free",
+
+        # vegan / vegetarian
+        "vegan": "vegan",
+        "strict vegan": "vegan",
+        "vegetarian": "vegetarian",
+        "lacto ovo vegetarian": "lacto ovo vegetarian",
+
+        # pescetarian
+        "pescetarian": "pescetarian",
+        "pescatarian": "pescetarian",
+    }.items()
+}
 
 
 class DietaryRestrictionAgent:
@@ -6,81 +35,53 @@ class DietaryRestrictionAgent:
     Final filter: ensures recipes comply with dietary restrictions and allergies.
     """
 
+    # Tags that are actually enforced as diet constraints
+    _DIET_TAGS = frozenset(DIET_BITS)
+
     def __init__(self, debug: bool = False):
         self.debug = debug
-
-        # Canonical mapping for common restriction labels
-        self.canonical_map = {
-            # gluten-related
-            "gluten-free": "gluten free",
-            "gluten free": "gluten free",
-            "celiac": "gluten free",
-            "celiac disease": "gluten free",
-
-            # vegan / vegetarian
-            "vegan": "vegan",
-            "strict vegan": "vegan",
-            "vegetarian": "vegetarian",
-            "lacto ovo vegetarian": "lacto ovo vegetarian",
-
-            # pescetarian
-            "pescetarian": "pescetarian",
-            "pescatarian": "pescetarian",
-        }
+        self.canonical_map = _CANON
 
     def _normalise_restrictions(self, restrictions):
         """
         Map user-facing labels to canonical diet tags that we expect in recipe.diets.
         """
-        required_tags = set()
-        for r in restrictions:
-            r_lower = r.strip().lower()
-            if not r_lower:
-                continue
-            if r_lower in self.canonical_map:
-                required_tags.add(self.canonical_map[r_lower])
-            else:
-                required_tags.add(r_lower)
-        return required_tags
-
-    def _matches_lifestyle(self, recipe: Recipe, restrictions):
+        # Sorted tuple so the same restriction set always hits the same entry
+        return _normalise_restriction_labels(tuple(sorted(restrictions)))
+
+    def _matches_lifestyle(self, recipe: Recipe, required_tags):
         """
-        Check that the recipe satisfies all required diet tags.
+        Check that the recipe satisfies all required diet tags
+        (already normalised via _normalise_restrictions).
         """
-        recipe_diets_lower = {d.lower() for d in (recipe.diets or [])}
-        required_tags = self._normalise_restrictions(restrictions)
+        recipe_diets_lower = recipe._diets_lower
 
         if self.debug:
             print(f"[DietaryAgent] Recipe: {recipe.name}")
-            print(f"  recipe.diets (norm): {recipe_diets_lower}")
-            print(f"  required_tags:       {required_tags}")
+            print(f"  recipe.diets (norm): {set(recipe_diets_lower)}")
+            print(f"  required_tags:       {set(required_tags)}")
 
-        for tag in required_tags:
-            # Only enforce tags that are actually diet constraints
-            if tag in {"gluten free", "vegan", "vegetarian", "lacto ovo vegetarian", "pescetarian"}:
-                if tag not in recipe_diets_lower:
-                    if self.debug:
-                        print(f"  -> FAIL: missing required tag '{tag}'\n")
-                    return False
+        # Only enforce tags that are actually diet constraints
+        missing = (required_tags & self._DIET_TAGS) - recipe_diets_lower
+        if missing:
+            if self.debug:
+                print(f"  -> FAIL: missing required tag '{sorted(missing)[0]}'\n")
+            return False
 
         if self.debug:
             print("  -> PASS lifestyle\n")
         return True
 
-    def _violates_allergies(self, recipe: Recipe, allergies):
+    def _violates_allergies(self, recipe: Recipe, allergies_lower):
         """
-        True if any of the user's allergies are present in recipe.allergens.
+        True if any of the user's allergies are present in recipe.allergens
+        (both sides in models.normalise_tag form).
         """
-        recipe_allergens_lower = {a.lower() for a in (recipe.allergens or [])}
-        for allergy in allergies:
-            a = allergy.strip().lower()
-            if not a:
-                continue
-            if a in recipe_allergens_lower:
-                if self.debug:
-                    print(f"[DietaryAgent] Recipe {recipe.name} violates allergy '{a}'")
-                return True
-        return False
+        violates = not allergies_lower.isdisjoint(recipe._allergens_lower)
+        if violates and self.debug:
+            hit = sorted(allergies_lower & recipe._allergens_lower)[0]
+            print(f"[DietaryAgent] Recipe {recipe.name} violates allergy '{hit}'")
+        return violates
 
     def filter_recipes(self, recipes, user: UserProfile):
         """
@@ -88,11 +89,78 @@ class DietaryRestrictionAgent:
         - match all lifestyle restrictions
         - do not violate allergies
         """
-        filtered = []
-        for recipe in recipes:
-            if not self._matches_lifestyle(recipe, user.dietary_restrictions):
-                continue
-            if self._violates_allergies(recipe, user.allergies):
-                continue
-            filtered.append(recipe)
-        return filtered
+        if self.debug:
+            # Slow path that explains each decision; user-side sets are
+            # normalised once, not per recipe
+            required_tags = self._normalise_restrictions(user.dietary_restrictions)
+            allergies_lower = normalised_tags(user.allergies)
+            filtered = []
+            for recipe in recipes:
+                if not self._matches_lifestyle(recipe, required_tags):
+                    continue
+                if self._violates_allergies(recipe, allergies_lower):
+                    continue
+                filtered.append(recipe)
+            return filtered
+
+        # Fast path: one comprehension of integer mask tests against masks
+        # built at ingestion; no per-recipe method / closure calls
+        dm, am = self._user_masks(user)
+        if not dm and not am:
+            return list(recipes)
+        return [
+            r for r in recipes
+            if (r._diet_mask & dm) == dm and not (r._allergen_mask & am)
+        ]
+
+    def _user_masks(self, user: UserProfile):
+        """(diet_mask, allergen_mask) the user's recipes must satisfy / avoid."""
+        user_diet_mask = 0
+        for tag in self._normalise_restrictions(user.dietary_restrictions):
+            user_diet_mask |= DIET_BITS.get(tag, 0)
+        # Registered (not skipped) so recipes ingested later still get these bits
+        user_allergen_mask = allergen_mask(user.allergies)
+        return user_diet_mask, user_allergen_mask
+
+    def compile_filter(self, user: UserProfile):
+        """
+        Predicate `recipe -> bool` equivalent to filter_recipes for `user`,
+        specialised to the constraints the user actually has, with their
+        masks bound as closure constants. Used to filter provider batches
+        as they stream in.
+        """
+        user_diet_mask, user_allergen_mask = self._user_masks(user)
+
+        if not user_diet_mask and not user_allergen_mask:
+            return _accept_all
+
+        if not user_allergen_mask:
+            def keep(recipe: Recipe) -> bool:
+                return (recipe._diet_mask & user_diet_mask) == user_diet_mask
+        elif not user_diet_mask:
+            def keep(recipe: Recipe) -> bool:
+                return not (recipe._allergen_mask & user_allergen_mask)
+        else:
+            def keep(recipe: Recipe) -> bool:
+                return (
+                    (recipe._diet_mask & user_diet_mask) == user_diet_mask
+                    and not (recipe._allergen_mask & user_allergen_mask)
+                )
+
+        return keep
+
+
+@functools.lru_cache(maxsize=512)
+def _normalise_restriction_labels(restrictions: tuple) -> frozenset:
+    required_tags = set()
+    for r in restrictions:
+        r_lower = normalise_tag(r)
+        if not r_lower:
+            continue
+        required_tags.add(_CANON.get(r_lower, r_lower))
+    return frozenset(required_tags)
+
+
+def _accept_all(recipe: Recipe) -> bool:
+    """Filter for users with no enforceable restrictions or allergies."""
+    return True
@@ -102,15 +102,18 @@ class IngredientAgent:
         # Map ids back to Recipe objects
         id_to_recipe = {r.id: r for r in recipes}
         ranked_recipes = []
+        seen = set()  # Recipe objects hash by identity, same as the list check
 
         for rid in ranked_ids:
             recipe = id_to_recipe.get(rid)
-            if recipe is not None and recipe not in ranked_recipes:
+            if recipe is not None and recipe not in seen:
+                seen.add(recipe)
                 ranked_recipes.append(recipe)
 
         # Append any recipes the model omitted
         for r in recipes:
-            if r not in ranked_recipes:
+            if r not in seen:
+                seen.add(r)
                 ranked_recipes.append(r)
 
         return ranked_recipes[:top_k]
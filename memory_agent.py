@@ -1,23 +1,59 @@
 # memory_agent.py
-import pandas as pd
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
+from openpyxl import Workbook, load_workbook
 from models import UserProfile
+import atexit
+import contextlib
 import json
 import os
+import sqlite3
+import threading
+import time
+
+# Faster JSON for the PROFILE_DATA payload when orjson is available
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+except ImportError:
+    _json_loads = json.loads
+    _json_dumps = json.dumps
 
 
 class MemoryAgent:
     """
     Agent responsible for long-term memory stored in an Excel sheet.
     This version is fully consistent and error-free. 
+
+    Writes are upserted into a SQLite journal next to the workbook
+    (<excel_file_path>.db) and applied to the in-memory DataFrame and the
+    cached openpyxl workbook's cells; the workbook itself is saved by
+    flush_to_excel(), at most once per `flush_interval` seconds after a
+    write, inside batch() exits, and at exit.
     """
 
     # ---------------------------------------------------------
     # INITIALISATION
     # ---------------------------------------------------------
-    def __init__(self, excel_file_path: str):
+    def __init__(self, excel_file_path: str, flush_interval: Optional[float] = 2.0):
         self.excel_file_path = excel_file_path
 
+        # Debounced Excel export: writes only mark the table dirty
+        self._dirty = False
+        self._autoflush = flush_interval is not None
+        self._flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+
+        # Guards self._data + the file; saves may come from a background writer
+        self._lock = threading.RLock()
+
+        # username -> UserProfile as it would be parsed back from the sheet;
+        # callers always get a copy, so they can mutate it freely
+        self._profile_cache: Dict[str, UserProfile] = {}
+
         # Ensure directory exists
         directory = os.path.dirname(excel_file_path)
         if directory and not os.path.exists(directory):
@@ -25,20 +61,87 @@ class MemoryAgent:
 
         # Create file if missing
         if not os.path.exists(excel_file_path):
-            df = pd.DataFrame({
-                "UserName": [],
-                "DietRules": [],
-                "ConvSummary": []
-            })
-            df.to_excel(excel_file_path, index=False)
+            wb = Workbook()
+            wb.active.append(["UserName", "DietRules", "ConvSummary"])
+            wb.save(excel_file_path)
+
+        # Journal of rows written since the last Excel flush
+        self._conn = sqlite3.connect(excel_file_path + ".db", check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS users("
+            "UserName TEXT PRIMARY KEY, DietRules TEXT, ConvSummary TEXT)"
+        )
+        self._conn.commit()
 
-        # Load workbook
-        self.df = pd.read_excel(excel_file_path)
+        # Load workbook (reloaded later only if the file changes on disk),
+        # then replay anything journaled but not yet flushed
+        self._mtime = None
+        self._load_excel()
 
-        # Ensure required columns exist
-        for col in ["UserName", "DietRules", "ConvSummary"]:
-            if col not in self.df.columns:
-                self.df[col] = ""
+        # Rows left over from a previous run still need exporting
+        self._dirty = self._conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is not None
+
+        atexit.register(self.flush_to_excel)
+
+    # ---------------------------------------------------------
+    # WORKBOOK I/O
+    # ---------------------------------------------------------
+    def _load_excel(self):
+        """
+        Load the workbook once and keep it (self._wb / self._ws) so writes
+        become cell updates and flushes a single save, plus a username ->
+        sheet row map. self._data mirrors the sheet as
+        {username: {"DietRules": ..., "ConvSummary": ...}}; empty cells
+        read back as None.
+        """
+        wb = load_workbook(self.excel_file_path)
+        ws = wb.worksheets[0]
+        rows = ws.iter_rows(values_only=True)
+        header = [h for h in (next(rows, None) or ()) if h is not None]
+
+        # Ensure required columns exist (missing ones read back as "")
+        missing = [c for c in ("UserName", "DietRules", "ConvSummary") if c not in header]
+        for col in missing:
+            ws.cell(1, len(header) + 1).value = col
+            header.append(col)
+        self._cols = {name: i for i, name in enumerate(header, start=1)}
+        user_i, diet_i, summary_i = (self._cols[c] - 1 for c in ("UserName", "DietRules", "ConvSummary"))
+
+        self._data: Dict[str, Dict[str, Any]] = {}
+        self._rows = {}
+        for row_idx, row in enumerate(rows, start=2):
+            if not any(v is not None for v in row):
+                continue
+            row = row + ("",) * (len(header) - len(row))
+            username = row[user_i]
+            # A hand-edited sheet may list a user twice; first row wins
+            if username is None or username in self._data:
+                continue
+            self._data[username] = {"DietRules": row[diet_i], "ConvSummary": row[summary_i]}
+            self._rows[username] = row_idx
+
+        self._wb, self._ws = wb, ws
+        self._mtime = os.path.getmtime(self.excel_file_path)
+
+        for username, diet_rules, summary in self._conn.execute(
+            "SELECT UserName, DietRules, ConvSummary FROM users"
+        ):
+            self._set_row(username, diet_rules, summary)
+
+    def _refresh(self):
+        """Reload self._data only if the file was modified outside this agent."""
+        try:
+            mtime = os.path.getmtime(self.excel_file_path)
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.reload()
+
+    def reload(self):
+        """Re-read the workbook and drop every cached profile."""
+        with self._lock:
+            self._profile_cache.clear()
+            self._load_excel()
 
     # ---------------------------------------------------------
     # LOAD USER PROFILE
@@ -48,31 +151,54 @@ class MemoryAgent:
         Converts row in Excel → UserProfile object
         """
         try:
-            if username not in self.df["UserName"].values:
-                return None
-
-            row = self.df[self.df["UserName"] == username].iloc[0]
+            with self._lock:
+                self._refresh()
+                profile = self._profile_cache.get(username)
+                if profile is None:
+                    row = self._data.get(username)
+                    if row is None:
+                        return None
 
-            profile = UserProfile(
-                user_id=username,
-                name=username
-            )
+                    profile = self._build_profile(username, row["DietRules"], row["ConvSummary"])
+                    self._profile_cache[username] = profile
 
-            # Load restrictions
-            if pd.notna(row["DietRules"]) and row["DietRules"] != "":
-                profile.dietary_restrictions = self._parse_dietary_restrictions(row["DietRules"])
-
-            # Load conversation summary → profile fields
-            if pd.notna(row["ConvSummary"]) and row["ConvSummary"] != "":
-                data = self._parse_conversation_summary(row["ConvSummary"])
-                self._update_profile_from_summary(profile, data)
-
-            return profile
+            return self._clone_profile(profile)
 
         except Exception as e:
             print(f"Error loading user profile: {e}")
             return None
 
+    def _build_profile(self, username: str, diet_rules, summary) -> UserProfile:
+        profile = UserProfile(
+            user_id=username,
+            name=username
+        )
+
+        # Load restrictions
+        if diet_rules is not None and diet_rules != "":
+            profile.dietary_restrictions = self._parse_dietary_restrictions(diet_rules)
+
+        # Load conversation summary → profile fields
+        if summary is not None and summary != "":
+            data = self._parse_conversation_summary(summary)
+            self._update_profile_from_summary(profile, data)
+
+        return profile
+
+    @staticmethod
+    def _clone_profile(p: UserProfile) -> UserProfile:
+        return UserProfile(
+            user_id=p.user_id,
+            name=p.name,
+            age=p.age,
+            likes=set(p.likes),
+            dislikes=set(p.dislikes),
+            dietary_restrictions=set(p.dietary_restrictions),
+            allergies=set(p.allergies),
+            objective=p.objective,
+            inventory=set(p.inventory),
+        )
+
     # ---------------------------------------------------------
     # SAVE USER PROFILE
     # ---------------------------------------------------------
@@ -80,64 +206,149 @@ class MemoryAgent:
         """
         Writes UserProfile back into Excel
         """
+        return self.save_user_profiles([(user, conversation_context)])
+
+    def save_user_profiles(self, profiles: List[Tuple[UserProfile, Optional[str]]]) -> Dict[str, Any]:
+        """
+        Writes several (UserProfile, conversation_context) pairs in one
+        journal transaction
+        """
         try:
-            username = user.user_id
+            with self._lock:
+                with self._conn:
+                    self._refresh()
+                    for user, conversation_context in profiles:
+                        self._apply_profile(user, conversation_context)
+                self._mark_dirty()
+            return {"status": "success"}
 
-            diet_rules_str = self._format_dietary_restrictions(user)
-            summary_str = self._create_conversation_summary(user, conversation_context)
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
 
-            if username in self.df["UserName"].values:
-                self.df.loc[self.df["UserName"] == username, "DietRules"] = diet_rules_str
-                self.df.loc[self.df["UserName"] == username, "ConvSummary"] = summary_str
-            else:
-                new_row = pd.DataFrame({
-                    "UserName": [username],
-                    "DietRules": [diet_rules_str],
-                    "ConvSummary": [summary_str]
-                })
-                self.df = pd.concat([self.df, new_row], ignore_index=True)
-
-            self.df.to_excel(self.excel_file_path, index=False)
+    def _apply_profile(self, user: UserProfile, conversation_context: str = None):
+        username = user.user_id
+
+        diet_rules_str = self._format_dietary_restrictions(user)
+        summary_str = self._create_conversation_summary(user, conversation_context)
+
+        self._set_row(username, diet_rules_str, summary_str)
+        self._journal(username, diet_rules_str, summary_str)
+
+        # Write-through: cache exactly what a fresh load would parse back
+        self._profile_cache[username] = self._build_profile(username, diet_rules_str, summary_str)
+
+    def _mark_dirty(self):
+        self._dirty = True
+        if (
+            self._autoflush
+            and time.monotonic() - self._last_flush > self._flush_interval
+        ):
+            self.flush_to_excel()
+
+    def _journal(self, username: str, diet_rules: str, summary: str):
+        # Caller holds self._lock and commits (``with self._conn``)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO users(UserName, DietRules, ConvSummary) VALUES (?, ?, ?)",
+            (username, diet_rules, summary),
+        )
+
+    def _set_row(self, username: str, diet_rules: str, summary: str):
+        # Updates in place, or appends a new row for a new user
+        self._data[username] = {"DietRules": diet_rules, "ConvSummary": summary}
+
+        row_idx = self._rows.get(username)
+        if row_idx is None:
+            row_idx = self._rows[username] = self._ws.max_row + 1
+            self._ws.cell(row_idx, self._cols["UserName"]).value = username
+        self._ws.cell(row_idx, self._cols["DietRules"]).value = diet_rules
+        self._ws.cell(row_idx, self._cols["ConvSummary"]).value = summary
+
+    def _write_excel(self):
+        """
+        Save the cached workbook (cells are already up to date) and swap the
+        file in atomically.
+        """
+        tmp_path = self.excel_file_path + ".tmp"
+        self._wb.save(tmp_path)
+        os.replace(tmp_path, self.excel_file_path)
+        self._mtime = os.path.getmtime(self.excel_file_path)
+
+    def flush_to_excel(self) -> Dict[str, Any]:
+        """
+        Export the current table to the workbook and clear the journal.
+        """
+        try:
+            with self._lock:
+                if not self._dirty:
+                    return {"status": "success"}
+                self._write_excel()
+                with self._conn:
+                    self._conn.execute("DELETE FROM users")
+                self._dirty = False
+                self._last_flush = time.monotonic()
             return {"status": "success"}
 
         except Exception as e:
             return {"status": "error", "message": str(e)}
 
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Suspend debounced flushes for bulk updates; the workbook is written
+        once when the block exits.
+        """
+        previous = self._autoflush
+        self._autoflush = False
+        try:
+            yield self
+        finally:
+            self._autoflush = previous
+            self.flush_to_excel()
+
     # ---------------------------------------------------------
     # UPDATE CONVERSATION MEMORY
     # ---------------------------------------------------------
     def update_conversation_memory(self, username: str, new_context: str, append: bool = True):
-        if username not in self.df["UserName"].values:
-            return {"status": "error", "message": "User not found"}
+        with self._lock:
+            self._refresh()
+            row = self._data.get(username)
+            if row is None:
+                return {"status": "error", "message": "User not found"}
+            old = row["ConvSummary"]
 
-        old = self.df[self.df["UserName"] == username]["ConvSummary"].iloc[0]
-
-        if append and pd.notna(old) and old != "":
-            updated = f"{old}\n{new_context}"
-        else:
-            updated = new_context
+            if append and old is not None and old != "":
+                updated = f"{old}\n{new_context}"
+            else:
+                updated = new_context
 
-        self.df.loc[self.df["UserName"] == username, "ConvSummary"] = updated
-        self.df.to_excel(self.excel_file_path, index=False)
+            diet_rules = row["DietRules"]
+            self._set_row(username, diet_rules, updated)
+            with self._conn:
+                self._journal(username, diet_rules, updated)
+            self._profile_cache[username] = self._build_profile(username, diet_rules, updated)
+            self._mark_dirty()
         return {"status": "success"}
 
     # ---------------------------------------------------------
     # API FOR YOUR example_usage.py
     # ---------------------------------------------------------
     def get_user_history(self, username: str):
-        if username not in self.df["UserName"].values:
-            return {"status": "error", "message": "User not found"}
-
-        row = self.df[self.df["UserName"] == username].iloc[0]
+        with self._lock:
+            self._refresh()
+            row = self._data.get(username)
+            if row is None:
+                return {"status": "error", "message": "User not found"}
         return {
             "status": "success",
-            "UserName": row["UserName"],
+            "UserName": username,
             "DietRules": row["DietRules"],
             "ConvSummary": row["ConvSummary"]
         }
 
     def list_all_users(self):
-        return list(self.df["UserName"].dropna().unique())
+        with self._lock:
+            self._refresh()
+            return list(self._data)
 
     # ---------------------------------------------------------
     # HELPER METHODS
@@ -161,7 +372,7 @@ class MemoryAgent:
             "inventory": list(user.inventory),
             "allergies": list(user.allergies),
         }
-        base = f"PROFILE_DATA: {json.dumps(payload)}"
+        base = f"PROFILE_DATA: {_json_dumps(payload)}"
         return base if not ctx else base + "\n" + f"CONTEXT: {ctx}"
 
     def _parse_conversation_summary(self, s: str) -> Dict[str, Any]:
@@ -169,7 +380,7 @@ class MemoryAgent:
         try:
             if "PROFILE_DATA:" in s:
                 json_part = s.split("PROFILE_DATA:", 1)[1].split("\n")[0].strip()
-                out = json.loads(json_part)
+                out = _json_loads(json_part)
         except:
             pass
         return out
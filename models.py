@@ -1,10 +1,92 @@
 # models.py
-from typing import Optional, Set
+import functools
+import sys
+import threading
+from typing import Iterable, Optional, Set
 
+# One bit per diet tag the dietary filter enforces
+DIET_BITS = {
+    "gluten free": 1 << 0,
+    "vegan": 1 << 1,
+    "vegetarian": 1 << 2,
+    "lacto ovo vegetarian": 1 << 3,
+    "pescetarian": 1 << 4,
+}
+
+# Allergen labels are open-ended, so bits are assigned on first sight, up to
+# 63 named labels. Every label after that shares the "other" bit, which only
+# over-filters (a user with any overflow allergy skips recipes tagged with
+# any overflow label) and keeps masks within 64 bits
+ALLERGEN_BITS = {}
+_MAX_NAMED_ALLERGENS = 63
+OTHER_ALLERGEN_BIT = 1 << _MAX_NAMED_ALLERGENS
+_ALLERGEN_LOCK = threading.Lock()
+
+
+@functools.lru_cache(maxsize=4096)
+def normalise_tag(tag: str) -> str:
+    """
+    Interned, stripped, lower-cased form of a diet / allergen label. Both
+    dietary filter paths (sets and bitmasks) compare labels in this form;
+    the tag vocabulary is small.
+    """
+    return sys.intern(tag.strip().lower())
+
+
+def normalised_tags(tags: Iterable[str]) -> frozenset:
+    """normalise_tag over `tags`, dropping labels that are blank."""
+    return frozenset(t for t in map(normalise_tag, tags) if t)
+
+
+def diet_mask(tags: Iterable[str]) -> int:
+    """OR of DIET_BITS for the known tags in `tags` (normalised first)."""
+    mask = 0
+    for t in tags:
+        mask |= DIET_BITS.get(normalise_tag(t), 0)
+    return mask
+
+
+def allergen_mask(tags: Iterable[str], register: bool = True) -> int:
+    """
+    OR of ALLERGEN_BITS for `tags`. Unknown labels get a fresh bit when
+    `register` is true; otherwise they are skipped (no recipe can carry them).
+    Once the registry is full, unknown labels map to OTHER_ALLERGEN_BIT.
+    """
+    mask = 0
+    for t in tags:
+        key = normalise_tag(t)
+        if not key:
+            continue
+        bit = ALLERGEN_BITS.get(key)
+        if bit is None:
+            bit = _register_allergen(key, register)
+        mask |= bit
+    return mask
+
+
+def _register_allergen(key: str, register: bool) -> int:
+    # Locked: concurrent sessions must never hand one bit to two labels
+    with _ALLERGEN_LOCK:
+        bit = ALLERGEN_BITS.get(key)
+        if bit is not None:
+            return bit
+        if len(ALLERGEN_BITS) >= _MAX_NAMED_ALLERGENS:
+            return OTHER_ALLERGEN_BIT
+        if not register:
+            return 0
+        bit = ALLERGEN_BITS[key] = 1 << len(ALLERGEN_BITS)
+        return bit
 
-# models.py
 
 class Recipe:
+    # Allocated per catalog entry, so no per-instance __dict__
+    __slots__ = (
+        "recipe_id", "id", "name", "ingredients", "diets", "allergens",
+        "calories", "protein", "carbs", "fat", "fiber",
+        "instructions", "source_url",
+        "_diets_lower", "_allergens_lower", "_diet_mask", "_allergen_mask",
+    )
+
     def __init__(
         self,
         recipe_id: str,
@@ -34,11 +116,23 @@ class Recipe:
         self.instructions = instructions  # <-- new
         self.source_url = source_url      # <-- new
 
+        # Normalised tag sets + bitmasks, computed once for DietaryRestrictionAgent
+        # (interned, so probes against the interned canonical tags hit by identity)
+        self._diets_lower = normalised_tags(self.diets)
+        self._allergens_lower = normalised_tags(self.allergens)
+        self._diet_mask = diet_mask(self._diets_lower)
+        self._allergen_mask = allergen_mask(self._allergens_lower)
+
     def __repr__(self):
         return f"<Recipe {self.name} ({self.calories} kcal)>"
 
 
 class UserProfile:
+    __slots__ = (
+        "user_id", "name", "age", "likes", "dislikes",
+        "dietary_restrictions", "allergies", "objective", "inventory",
+    )
+
     def __init__(
         self,
         user_id: str,
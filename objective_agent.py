@@ -1,8 +1,52 @@
 # objective_agent.py
 
 import json
+import operator
 from openai import OpenAI
 
+# Faster JSON when orjson is available
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+except ImportError:
+    _json_loads = json.loads
+    _json_dumps = json.dumps
+
+# Recipe fields sent to the model, read in one attrgetter call per recipe
+_PAYLOAD_FIELDS = ("id", "name", "calories", "protein", "carbs", "fat")
+_RECIPE_FIELDS = operator.attrgetter(*_PAYLOAD_FIELDS)
+
+# Objectives whose ranking is just a sort on the numbers, no LLM needed
+_CUTTING_OBJECTIVES = frozenset({"cutting", "fat loss"})
+_BULKING_OBJECTIVES = frozenset({"bulking", "muscle gain"})
+
+
+def _cutting_key(r):
+    # Fewest calories first; protein breaks ties. Unknown calories sort last
+    return (r.calories or 9e9, -(r.protein or 0))
+
+
+def _bulking_key(r):
+    return (-(r.protein or 0), -(r.calories or 0))
+
+
+def objective_sort_key(objective):
+    """
+    Sort key that ranks recipes for `objective` without an LLM call, or
+    None if the objective needs the model's judgement ('healthier', ...).
+    """
+    objective = (objective or "").strip().lower()
+    if objective in _CUTTING_OBJECTIVES:
+        return _cutting_key
+    if objective in _BULKING_OBJECTIVES:
+        return _bulking_key
+    return None
+
+
 class ObjectiveAgent:
     """
     Uses gpt-4o-mini (Responses API) to re-rank recipes according to user's objective:
@@ -14,18 +58,9 @@ class ObjectiveAgent:
         self.model = model
 
     def _build_payload(self, recipes, user):
-        recipe_summaries = []
-        for r in recipes:
-            recipe_summaries.append(
-                {
-                    "id": r.id,
-                    "name": r.name,
-                    "calories": r.calories,
-                    "protein": r.protein,
-                    "carbs": r.carbs,
-                    "fat": r.fat,
-                }
-            )
+        recipe_summaries = [
+            dict(zip(_PAYLOAD_FIELDS, _RECIPE_FIELDS(r))) for r in recipes
+        ]
 
         payload = {
             "objective": user.objective or "healthier",
@@ -63,7 +98,7 @@ class ObjectiveAgent:
                     "content": [
                         {
                             "type": "text",
-                            "text": json.dumps(payload),
+                            "text": _json_dumps(payload),
                         }
                     ],
                 },
@@ -95,7 +130,7 @@ class ObjectiveAgent:
 
         try:
             content = self._call_llm_for_ranking(payload, temperature)
-            data = json.loads(content)
+            data = _json_loads(content)
             ranked_ids = data.get("ranked_ids", [])
             # notes = data.get("notes", "")  # use in UI/LLM response if needed
         except Exception:
@@ -103,14 +138,17 @@ class ObjectiveAgent:
 
         id_to_recipe = {r.id: r for r in recipes}
         ranked_recipes = []
+        seen = set()  # Recipe objects hash by identity, same as the list check
 
         for rid in ranked_ids:
             recipe = id_to_recipe.get(rid)
-            if recipe is not None and recipe not in ranked_recipes:
+            if recipe is not None and recipe not in seen:
+                seen.add(recipe)
                 ranked_recipes.append(recipe)
 
         for r in recipes:
-            if r not in ranked_recipes:
+            if r not in seen:
+                seen.add(r)
                 ranked_recipes.append(r)
 
         return ranked_recipes[:top_k]
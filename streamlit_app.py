@@ -1,12 +1,24 @@
 # app.py
-import base64
+import hashlib
 import io
-import os
 import json
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+import httpx
 import streamlit as st
 from openai import OpenAI
+from PIL import Image, ImageOps
 from conversational_agent import ConversationalAgent
 
+# SIMD base64 for the photo payload when pybase64 is installed (same API)
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
 # ---------------------------
 # Setup
 # ---------------------------
@@ -17,181 +29,50 @@ st.set_page_config(
     layout="centered",
 )
 
-st.markdown("""
-<style>
-@import url('https://fonts.googleapis.com/css2?family=Playfair+Display:wght@400;500;600;700&family=Dancing+Script:wght@500;600&display=swap');
-
-/* ===== Global background: remove white bars top/bottom ===== */
-html, body {
-    background: linear-gradient(180deg, #faf4e8 0%, #f6efdf 45%, #f1ebdd 100%) !important;
-}
-.stApp,
-main,
-section.main,
-div[data-testid="stAppViewContainer"],
-div[data-testid="stHeader"],
-footer,
-div[data-testid="stDecoration"] {
-    background: transparent !important;
-}
-
-/* Main app text baseline */
-.stApp {
-    color: #354436;
-    font-family: 'Playfair Display', Georgia, 'Times New Roman', serif;
-}
-
-/* Layout container shadow */
-div[data-testid="stAppViewContainer"] {
-    padding-top: 1rem;
-    box-shadow: inset 0 0 60px rgba(190, 170, 120, 0.08);
-}
-
-/* Headings */
-h1, h2, h3, h4 {
-    font-family: 'Dancing Script', 'Playfair Display', serif;
-    color: #2f4a34;
-    letter-spacing: 0.8px;
-    font-weight: 600;
-    text-shadow: 0 1px 2px rgba(60, 80, 60, 0.18);
-}
-h1 { font-size: 2.8rem !important; margin-bottom: 0.1rem; }
-h2 { font-size: 1.8rem !important; }
-
-/* Sidebar */
-section[data-testid="stSidebar"] {
-    background: linear-gradient(180deg, #f3ecdb 0%, #e8dfc7 100%);
-    border-right: 1px solid #d2c5a7;
-}
-section[data-testid="stSidebar"] * {
-    font-family: 'Playfair Display', Georgia, serif;
-}
-div[data-testid="collapsedControl"] {
-    font-size: 0 !important; /* hide off-centre label */
-}
-
-/* Chat messages */
-.stChatMessage {
-    background-color: #fffcf5;
-    border-radius: 14px;
-    border: 1px solid rgba(197,176,139,0.8);
-    box-shadow: 0 4px 10px rgba(160,130,90,0.14);
-    padding: 0.9rem 1rem;
-    margin-bottom: 0.8rem;
-}
-.stChatMessage[data-testid="stChatMessage-user"] {
-    background: linear-gradient(135deg, #faf1e2 0%, #f6e6cf 100%);
-    border-left: 4px solid #b6915f;
-}
-.stChatMessage[data-testid="stChatMessage-assistant"] {
-    background: linear-gradient(135deg, #f3f7f0 0%, #e6f0e4 100%);
-    border-left: 4px solid #7e9d78;
-}
-
-/* ===== Chat input: single clean pill, no inner line ===== */
-div[data-testid="stChatInput"] {
-    background: #fdf8ef !important;  /* slightly warmer cream */
-    border: 1px solid #d5cbb7 !important;
-    border-radius: 999px !important;
-}
-
-div[data-testid="stChatInput"] * {
-    box-shadow: none !important;
-}
-div[data-testid="stChatInput"] > div {
-    background: transparent !important;
-    border: none !important;
-}
-div[data-baseweb="textarea"] {
-    background: transparent !important;
-    border: none !important;
-}
-/* Fix inner blue/grey rectangle inside chat input */
-div[data-baseweb="base-input"] {
-    background: transparent !important;
-    border: none !important;
-    box-shadow: none !important;
-}
-div[data-testid="stChatInput"] textarea {
-    background: transparent !important;
-    border: none !important;
-    outline: none !important;
-    color: #3c4035 !important;
-    font-family: 'Playfair Display', Georgia, serif !important;
-    font-size: 1.05rem;
-}
-div[data-testid="stChatInput"] svg {
-    color: #7c7e78 !important;
-}
-
-/* Buttons */
-.stButton>button {
-    background: linear-gradient(135deg, #7c946a 0%, #6c835d 100%);
-    color: #fffaf0;
-    border-radius: 999px;
-    border: none;
-    padding: 0.4rem 1.1rem;
-    font-family: 'Playfair Display', serif;
-    font-style: italic;
-    transition: 0.15s ease-out;
-}
-.stButton>button:hover {
-    transform: translateY(-1px);
-    box-shadow: 0 4px 10px rgba(100,120,90,0.25);
-    filter: brightness(1.05);
-}
-
-/* Inputs */
-input, textarea, select {
-    background-color: #fffaf0 !important;
-    border: 1px solid #d5cdb7 !important;
-    border-radius: 8px !important;
-    color: #374635 !important;
-}
-
-/* Recipe cards */
-.recipe-card {
-    background: #fffcf7;
-    border-radius: 12px;
-    padding: 0.75rem 0.9rem;
-    margin-bottom: 0.6rem;
-    border: 1px solid rgba(210,190,150,0.9);
-    box-shadow: 0 3px 7px rgba(156,132,98,0.18);
-}
-.recipe-card-title {
-    font-family: 'Dancing Script', serif;
-    font-size: 1.25rem;
-    color: #2f4a34;
-}
-.recipe-card-macros { color: #3b5d3d; }
-
-/* Center chat messages on large screens */
-@media (min-width: 992px) {
-    .stChatMessage {
-        max-width: 780px;
-        margin-left: auto;
-        margin-right: auto;
-    }
-}
-</style>
-""", unsafe_allow_html=True)
+# Theme CSS is served once as a static file (see .streamlit/config.toml,
+# enableStaticServing) and cached by the browser; each rerun re-sends only
+# this <link> tag rather than the whole stylesheet
+st.markdown(
+    '<link rel="stylesheet" href="app/static/style.css">',
+    unsafe_allow_html=True,
+)
 
 # ---------------------------
 # Initialise Agent
 # ---------------------------
 
-client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+@st.cache_resource
+def get_openai_client() -> OpenAI:
+    # Built once per server process, not per rerun, and shared by the vision
+    # calls and the agent (chat + embeddings), so all reuse one keep-alive pool
+    return OpenAI(
+        api_key=st.secrets["OPENAI_API_KEY"],
+        http_client=httpx.Client(
+            limits=httpx.Limits(max_keepalive_connections=16, max_connections=32)
+        ),
+    )
 
-if "agent" not in st.session_state:
+
+client = get_openai_client()
+
+@st.cache_resource
+def get_agent() -> ConversationalAgent:
+    # One agent (its threads, pools and loaded workbook) shared by every
+    # browser session; conversation state is keyed by session_id below
     excel_path = "MemoryFiles/TestWorkBook.xlsx"
-    st.session_state.agent = ConversationalAgent(
+    return ConversationalAgent(
         model="gpt-4o-mini",
         excel_file_path=excel_path,
+        client=get_openai_client(),
     )
 
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+# Keys this session's "number 2"-style follow-ups in the shared agent
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
 if "username" not in st.session_state:
     st.session_state.username = "Ishaan"
 
@@ -199,12 +80,59 @@ if "username" not in st.session_state:
 # Helper: extract ingredients from image
 # ---------------------------
 
-import re  # add this near the top of the file
+@st.cache_resource
+def _vision_pool() -> ThreadPoolExecutor:
+    # One pool per server process, not one per rerun
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="vision")
+
+
+# Long edge the photo is downscaled to before upload; plenty for the model
+# to recognise food items, and a fraction of a phone photo's bytes
+VISION_MAX_EDGE = 1024
+
+# Output-token cap per photo for the vision reply
+VISION_MAX_TOKENS = 256
+
+def extract_ingredients_from_image(img_bytes: bytes) -> list[str]:
+    # Reruns resubmit the same photo; key the vision call on its content
+    img_sha = hashlib.blake2b(img_bytes, digest_size=16).hexdigest()
+    try:
+        return _vision_ingredients(img_sha, img_bytes)
+    except Exception as e:
+        # Failures raise out of the cached call, so they are retried next time
+        # Optional: temporary debug
+        # st.sidebar.write(f"Vision parse error: {e}")
+        return []
+
+
+@st.cache_data(show_spinner=False)
+def _vision_ingredients(img_sha: str, _img_bytes: bytes) -> list[str]:
+    # `_img_bytes` is skipped by Streamlit's hasher; img_sha is the key
+    im = Image.open(io.BytesIO(_img_bytes))
+    # JPEGs decode straight at a reduced DCT scale (no full-size bitmap of a
+    # 12MP photo in RAM); no-op for other formats
+    im.draft("RGB", (VISION_MAX_EDGE, VISION_MAX_EDGE))
+    # Re-encoding drops EXIF, so bake the camera orientation into the pixels
+    im = ImageOps.exif_transpose(im)
+    im.thumbnail((VISION_MAX_EDGE, VISION_MAX_EDGE), Image.LANCZOS)
+    buf = io.BytesIO()
+    im.convert("RGB").save(buf, "JPEG", quality=85, optimize=True)
+    img_bytes = buf.getvalue()
+    # Build the data URL as bytes and decode once (ASCII is a cheap decode)
+    data_url = (b"data:image/jpeg;base64," + base64.b64encode(img_bytes)).decode("ascii")
+
+    return _vision_batcher().submit(data_url).result()
+
+
+def _clean_ingredients(items) -> list[str]:
+    return [
+        i.strip()
+        for i in (items if isinstance(items, list) else [])
+        if isinstance(i, str) and i.strip()
+    ]
 
-def extract_ingredients_from_image(image_file) -> list[str]:
-    img_bytes = image_file.read()
-    b64 = base64.b64encode(img_bytes).decode("utf-8")
 
+def _vision_single(data_url: str) -> list[str]:
     messages = [
         {
             "role": "system",
@@ -223,61 +151,165 @@ def extract_ingredients_from_image(image_file) -> list[str]:
                 },
                 {
                     "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{b64}"},
+                    "image_url": {"url": data_url, "detail": "low"},
                 },
             ],
         },
     ]
 
+    completion = client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=messages,
+        temperature=0.1,
+        # A fridge's ingredient list fits well under this; caps runaway replies
+        max_tokens=VISION_MAX_TOKENS,
+        # JSON mode: the reply is a bare JSON object, no fences or prose
+        response_format={"type": "json_object"},
+    )
+    raw = completion.choices[0].message.content
+
+    data = json.loads(raw)
+    return _clean_ingredients(data.get("ingredients", []))
+
+
+def _vision_multi(data_urls: list[str]) -> list[list[str]]:
+    """One call for several photos; falls back to one call each if the reply is malformed."""
+    content = [
+        {
+            "type": "text",
+            "text": (
+                f"There are {len(data_urls)} separate photos below, each from a different user. "
+                "For each photo, list all ingredients or food items you can clearly identify in it."
+            ),
+        }
+    ]
+    for n, data_url in enumerate(data_urls, 1):
+        content.append({"type": "text", "text": f"Photo {n}:"})
+        content.append({"type": "image_url", "image_url": {"url": data_url, "detail": "low"}})
+
+    messages = [
+        {
+            "role": "system",
+            "content": (
+                "You are a helpful assistant that looks at photos of fridges or pantries "
+                "and lists visible food items. Never mix items between photos. "
+                "Return ONLY valid JSON with one key 'images' whose value is a list with "
+                "one list of strings per photo, in the order the photos were given."
+            ),
+        },
+        {"role": "user", "content": content},
+    ]
+
+    completion = client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=messages,
+        temperature=0.1,
+        max_tokens=VISION_MAX_TOKENS * len(data_urls),
+        response_format={"type": "json_object"},
+    )
     try:
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            temperature=0.1,
-        )
-        raw = completion.choices[0].message.content.strip()
-
-        # Strip ```json ... ``` fences if present
-        if raw.startswith("```"):
-            raw = raw.strip("`")
-            raw = re.sub(r"^json", "", raw, flags=re.IGNORECASE).strip()
-
-        # Extract JSON object substring
-        start = raw.find("{")
-        end = raw.rfind("}")
-        if start != -1 and end != -1:
-            raw_json = raw[start : end + 1]
-        else:
-            raw_json = raw
-
-        data = json.loads(raw_json)
-        ingredients = data.get("ingredients", [])
-        return [
-            i.strip()
-            for i in ingredients
-            if isinstance(i, str) and i.strip()
-        ]
-    except Exception as e:
-        # Optional: temporary debug
-        # st.sidebar.write(f"Vision parse error: {e}")
-        return []
+        images = json.loads(completion.choices[0].message.content).get("images")
+    except ValueError:
+        images = None  # e.g. cut off at max_tokens
+    if not isinstance(images, list) or len(images) != len(data_urls):
+        return [_vision_single(u) for u in data_urls]
+    return [_clean_ingredients(items) for items in images]
+
+
+class VisionBatcher:
+    """
+    Coalesces vision requests from concurrent sessions: requests arriving
+    within `window` seconds of each other (up to `max_batch`) share one
+    multi-image call, and each caller's Future gets its own photo's list.
+
+    The collector thread only groups requests; each batch's API call runs
+    on the batcher's own pool, so batches run concurrently. (Not on
+    _vision_pool: its workers block on these Futures, and sharing it
+    could deadlock.)
+    """
+
+    def __init__(self, window: float = 0.05, max_batch: int = 4, max_workers: int = 4):
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: queue.Queue = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="vision-batch")
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def submit(self, data_url: str) -> Future:
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((future, data_url))
+        return future
+
+    def _ensure_worker(self):
+        # (Re)start the collector if it has not started yet or has died
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._worker, name="vision-batcher", daemon=True
+                )
+                self._thread.start()
+
+    def _worker(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._pool.submit(self._run, batch)
+
+    def _run(self, batch):
+        futures = [f for f, _ in batch]
+        data_urls = [u for _, u in batch]
+        try:
+            if len(batch) == 1:
+                results = [_vision_single(data_urls[0])]
+            else:
+                results = _vision_multi(data_urls)
+        except Exception as e:
+            for f in futures:
+                f.set_exception(e)
+            return
+        for f, result in zip(futures, results):
+            f.set_result(result)
+
+
+@st.cache_resource
+def _vision_batcher() -> VisionBatcher:
+    return VisionBatcher()
 
 # ---------------------------
 # Sidebar
 # ---------------------------
 
-with st.sidebar:
+@st.fragment
+def render_sidebar():
+    # A fragment: editing the name, uploading a photo or ticking the box
+    # reruns only this block instead of redrawing the whole chat history;
+    # the values are read from session_state when a message is sent
     st.header("👩‍🍳 User profile")
     st.session_state.username = st.text_input("Name", value=st.session_state.username)
     st.markdown("---")
     st.header("📷 Fridge snapshot")
-    uploaded_image = st.file_uploader(
+    st.file_uploader(
         "Upload your fridge or pantry photo (optional)",
         type=["png", "jpg", "jpeg"],
+        key="fridge_photo",
     )
-    use_fridge_photo = st.checkbox("Use fridge photo for this request", value=False)
+    st.checkbox("Use fridge photo for this request", value=False, key="use_fridge_photo")
     st.markdown("---")
 
+
+with st.sidebar:
+    render_sidebar()
+
 # ---------------------------
 # Chat Interface
 # ---------------------------
@@ -291,36 +323,54 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
-for msg in st.session_state.messages:
+def render_history():
+    for msg in st.session_state.messages:
+        _render_message(msg)
+
+
+def _render_message(msg):
     with st.chat_message(msg["role"]):
         st.write(msg["content"])
         if msg.get("recipes"):
             st.markdown("**Top recipe suggestions:**")
-            for i, r in enumerate(msg["recipes"], 1):
-                details = []
-                if r.get("calories"):
-                    details.append(f"{r['calories']} kcal")
-                if r.get("protein"):
-                    details.append(f"{r['protein']} protein")
-                if r.get("carbs"):
-                    details.append(f"{r['carbs']} carbs")
-                if r.get("fat"):
-                    details.append(f"{r['fat']} fat")
-                if r.get("fiber"):
-                    details.append(f"{r['fiber']} fiber")
-
-                st.markdown(
-                    f"""
-                    <div class="recipe-card">
-                        <div class="recipe-card-title">{i}. {r['name']}</div>
-                        <div class="recipe-card-macros">
-                            {', '.join(details)}
-                        </div>
-                        {f"<a href='{r['url']}' target='_blank'>View recipe</a>" if r.get('url') else ''}
-                    </div>
-                    """,
-                    unsafe_allow_html=True,
-                )
+            # Card HTML is built once when the reply is logged
+            html = msg.get("html") or recipe_cards_html(msg["recipes"])
+            st.markdown(html, unsafe_allow_html=True)
+
+
+def _g(x):
+    """Grams label with two decimals, or None when the value is missing/zero."""
+    return f"{x:.2f} g" if x else None
+
+
+def recipe_cards_html(recipes) -> str:
+    return "".join(_recipe_card_html(i, r) for i, r in enumerate(recipes, 1))
+
+
+def _recipe_card_html(i, r) -> str:
+    details = []
+    if r.get("calories"):
+        details.append(f"{r['calories']} kcal")
+    if r.get("protein"):
+        details.append(f"{r['protein']} protein")
+    if r.get("carbs"):
+        details.append(f"{r['carbs']} carbs")
+    if r.get("fat"):
+        details.append(f"{r['fat']} fat")
+    if r.get("fiber"):
+        details.append(f"{r['fiber']} fiber")
+
+    link = f"<a href='{r['url']}' target='_blank'>View recipe</a>" if r.get("url") else ""
+    return (
+        '<div class="recipe-card">'
+        f'<div class="recipe-card-title">{i}. {r["name"]}</div>'
+        f'<div class="recipe-card-macros">{", ".join(details)}</div>'
+        f"{link}"
+        "</div>"
+    )
+
+
+render_history()
 
 # ---------------------------
 # User Input
@@ -334,26 +384,33 @@ user_input = st.chat_input("Ask for recipes, meal ideas, or nutrition tips...")
 
 if user_input:
     username = st.session_state.username
-    agent = st.session_state.agent
-
-    # 1. Extract ingredients from image (if used)
-    fridge_ingredients: list[str] = []
-    if use_fridge_photo and uploaded_image is not None:
-        fridge_ingredients = extract_ingredients_from_image(uploaded_image)
-
-    # Optional: show the detected ingredients in the UI so you can see what the model saw
-    if fridge_ingredients:
-        st.sidebar.caption("Detected from photo: " + ", ".join(fridge_ingredients))
+    agent = get_agent()
+
+    # 1. Extract ingredients from image (if used), in the background: the
+    #    agent only needs them after it has analysed the message
+    #    (only the photo's plain bytes are handed to the worker thread)
+    vision_future = None
+    uploaded_image = st.session_state.get("fridge_photo")
+    if st.session_state.get("use_fridge_photo") and uploaded_image is not None:
+        vision_future = _vision_pool().submit(
+            extract_ingredients_from_image, uploaded_image.getvalue()
+        )
 
     # 2. Call the agent with:
     #    - raw user text as `message`
-    #    - fridge ingredients as structured `extra_inventory`
+    #    - fridge ingredients (a Future, resolved inside) as structured `extra_inventory`
     recipes, parsed_request, user_profile, save_result = agent.handle_message(
         username,
         user_input,                 # <<< do NOT append fridge ingredients here
-        extra_inventory=fridge_ingredients or None,
+        extra_inventory=vision_future,
+        session_id=st.session_state.session_id,
     )
 
+    # Optional: show the detected ingredients in the UI so you can see what the model saw
+    fridge_ingredients = vision_future.result() if vision_future is not None else []
+    if fridge_ingredients:
+        st.sidebar.caption("Detected from photo: " + ", ".join(fridge_ingredients))
+
     # 3. Build reply
     if parsed_request.get("action") == "inventory_cleared":
         reply_text = "Your fridge inventory has been cleared."
@@ -368,18 +425,26 @@ if user_input:
     recipe_summaries = [
         {
             "name": r.name,
-            "calories": round(r.calories, 2) if r.calories else None,
-            "protein": f"{round(r.protein, 2)} g" if r.protein else None,
-            "carbs": f"{round(r.carbs, 2)} g" if r.carbs else None,
-            "fat": f"{round(r.fat, 2)} g" if r.fat else None,
-            "fiber": f"{round(r.fiber, 2)} g" if r.fiber else None,
+            "calories": f"{r.calories:.2f}" if r.calories else None,
+            "protein": _g(r.protein),
+            "carbs": _g(r.carbs),
+            "fat": _g(r.fat),
+            "fiber": _g(r.fiber),
             "url": r.source_url or getattr(r, "url", None) or None,
         }
         for r in recipes[:5]
     ]
 
     st.session_state.messages.append(
-        {"role": "assistant", "content": reply_text, "recipes": recipe_summaries}
+        {
+            "role": "assistant",
+            "content": reply_text,
+            "recipes": recipe_summaries,
+            "html": recipe_cards_html(recipe_summaries),
+        }
     )
 
-    st.rerun()
+    # 5. Draw just the new pair below the history already on screen; the
+    #    next run renders them as part of the history
+    for msg in st.session_state.messages[-2:]:
+        _render_message(msg)